@@ -4,7 +4,16 @@ This is from http://code.activestate.com/recipes/577197-sortedcollection/
 Credit: Raymond Hettinger
 '''
 
+import mmap
+import pickle
+import struct
+import threading
 from bisect import bisect_left, bisect_right
+from heapq import merge
+from itertools import chain
+from operator import itemgetter
+
+import numpy as np
 
 
 class SortedCollection:
@@ -22,14 +31,18 @@ class SortedCollection:
 
     Once found, an item's ordinal position can be located with the index() method.
     New items can be added with the insert() and insert_right() methods.
-    Old items can be deleted with the remove() method.
+    Old items can be deleted with the remove() method.  Batches of items are
+    merged in with update() and deleted with remove_many() in a single pass.
+    The items with keys in a range are counted with count_range() and
+    iterated with irange() without copying the rest of the sequence.
 
     The usual sequence methods are provided to support indexing, slicing,
     length lookup, clearing, copying, forward and reverse iteration, contains
     checking, item counts, item removal, and a nice looking repr.
 
     Finding and indexing are O(log n) operations while iteration and insertion
-    are O(n).  The initial sort is O(n log n).
+    are O(n).  The initial sort is O(n log n).  Merging m items is
+    O(n + m log m) and counting a range is O(log n).
 
     The key function is stored in the 'key' attibute for easy introspection or
     so that you can assign a new key function (triggering an automatic re-sort).
@@ -68,6 +81,15 @@ class SortedCollection:
     >>> s[3]                    # fetch the record at that index
     ('david', 'thomas', 32)
 
+    >>> s.count_range(25, 31)   # count people aged 25 to 31
+    2
+    >>> [r[0] for r in s.irange(25, 31)]
+    ['angela', 'roger']
+    >>> s.update([('erin', 'walsh', 27), ('fred', 'brown', 40)])
+    >>> [r[0] for r in s.irange(25)]
+    ['erin', 'angela', 'roger', 'david', 'fred']
+    >>> s.remove_many([('erin', 'walsh', 27), ('fred', 'brown', 40)])
+
     >>> s.key = itemgetter(0)   # now sort by first name
     >>> pprint(list(s))
     [('angela', 'jones', 28),
@@ -76,6 +98,7 @@ class SortedCollection:
      ('roger', 'young', 30)]
 
     '''
+    __slots__ = ('_given_key', '_key', '_keys', '_items')
 
     def __init__(self, iterable=(), key=None):
         self._given_key = key
@@ -124,6 +147,28 @@ class SortedCollection:
     def __reduce__(self):
         return self.__class__, (self._items, self._given_key)
 
+    def save(self, filename):
+        'Save the numeric keys and the items to a file for SortedSnapshot'
+        keys = NumericSortedCollection._as_keys(self._keys)
+        n = len(keys)
+        # header, keys, item offsets and pickled items, each 8-byte aligned
+        keys_start = _SNAPSHOT_HEADER.size
+        offsets_start = _align(keys_start + keys.nbytes)
+        items_start = offsets_start + 8 * (n + 1)
+        offsets = np.zeros(n + 1, dtype='<u8')
+        with open(filename, 'wb') as f:
+            f.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, keys.dtype.str.encode(), n))
+            f.write(keys.tobytes())
+            f.seek(items_start)
+            size = 0
+            for i, item in enumerate(self):
+                data = pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+                f.write(data)
+                size += len(data)
+                offsets[i + 1] = size
+            f.seek(offsets_start)
+            f.write(offsets.tobytes())
+
     def __contains__(self, item):
         k = self._key(item)
         i = bisect_left(self._keys, k)
@@ -164,6 +209,75 @@ class SortedCollection:
         del self._keys[i]
         del self._items[i]
 
+    def update(self, iterable):
+        'Insert a batch of items.  If equal keys are found, add to the right'
+        key = self._key
+        new = sorted(((key(item), item) for item in iterable), key=itemgetter(0))
+        if len(new) < 8:
+            # merging rebuilds both lists; a few bisect inserts are cheaper
+            for k, item in new:
+                i = bisect_right(self._keys, k)
+                self._keys.insert(i, k)
+                self._items.insert(i, item)
+            return
+        decorated = list(merge(zip(self._keys, self._items), new, key=itemgetter(0)))
+        self._keys = [k for k, item in decorated]
+        self._items = [item for k, item in decorated]
+
+    insert_many = update
+
+    def remove_many(self, iterable):
+        'Remove one occurence of each item.  Raise ValueError if any is not found'
+        drop = self._positions(iterable)
+        if drop:
+            keep = [p for p in range(len(self)) if p not in drop]
+            self._keys = [self._keys[p] for p in keep]
+            self._items = [self._items[p] for p in keep]
+
+    def _positions(self, iterable):
+        'Return the set of distinct positions holding the items'
+        drop = set()
+        for item in iterable:
+            k = self._key(item)
+            i = bisect_left(self._keys, k)
+            j = bisect_right(self._keys, k)
+            for p in range(i, j):
+                if p not in drop and self._items[p] == item:
+                    drop.add(p)
+                    break
+            else:
+                raise ValueError('%r not in %s' % (item, self.__class__.__name__))
+        return drop
+
+    def _range(self, lo, hi, inclusive):
+        'Return the positions bounding the keys from lo to hi'
+        left, right = inclusive
+        if lo is None:
+            i = 0
+        else:
+            i = (bisect_left if left else bisect_right)(self._keys, lo)
+        if hi is None:
+            j = len(self)
+        else:
+            j = (bisect_right if right else bisect_left)(self._keys, hi)
+        return i, max(i, j)
+
+    def irange(self, lo=None, hi=None, inclusive=(True, True)):
+        'Iterate over the items with keys between lo and hi.  None is unbounded'
+        i, j = self._range(lo, hi, inclusive)
+        return map(self._items.__getitem__, range(i, j))
+
+    def count_range(self, lo=None, hi=None, inclusive=(True, True)):
+        'Return number of items with keys between lo and hi.  None is unbounded'
+        i, j = self._range(lo, hi, inclusive)
+        return j - i
+
+    def remove_range(self, lo=None, hi=None, inclusive=(True, True)):
+        'Remove all items with keys between lo and hi.  None is unbounded'
+        i, j = self._range(lo, hi, inclusive)
+        del self._keys[i:j]
+        del self._items[i:j]
+
     def find(self, k):
         'Return first item with a key == k.  Raise ValueError if not found.'
         i = bisect_left(self._keys, k)
@@ -200,6 +314,982 @@ class SortedCollection:
         raise ValueError('No item found with key above: %r' % (k,))
 
 
+class ChunkedSortedCollection(SortedCollection):
+    '''SortedCollection stored as a list of bounded-size sorted sublists.
+
+    The flat lists of SortedCollection make every insertion and removal
+    shift O(n) references, which dominates once the collection grows past
+    about a million items.  Here the keys and items are kept in sublists of
+    ``load`` to ``2 * load`` entries, the largest key of every sublist is
+    kept in ``_maxes`` for bisecting and the sublist lengths are kept in a
+    Fenwick tree for positional lookup.  Finding, indexing, insertion and
+    removal are then O(log n + load); the API is that of SortedCollection.
+
+    Parameters
+    ----------
+    iterable : iterable
+        the initial items.
+    key : callable or None
+        the key function.
+    load : int or None
+        the target sublist size. Default to ``default_load``, or the
+        current one when the collection is cleared or re-keyed.
+
+    Examples
+    --------
+    >>> s = ChunkedSortedCollection(range(0, 100, 2), load=4)
+    >>> len(s), s[10], s[-1]
+    (50, 20, 98)
+    >>> s.insert(21)
+    >>> s.index(21), s.find_le(23), s[9:13]
+    (11, 22, [18, 20, 21, 22])
+    >>> s.remove_range(10, 89)
+    >>> list(s)
+    [0, 2, 4, 6, 8, 90, 92, 94, 96, 98]
+    >>> s.key = lambda x: -x
+    >>> s[:3]
+    [98, 96, 94]
+
+    '''
+    __slots__ = ('_load', '_kl', '_il', '_maxes', '_tree', '_len', '_owned')
+    default_load = 1000
+
+    def __init__(self, iterable=(), key=None, load=None):
+        self._load = load or getattr(self, '_load', self.default_load)
+        self._owned = None
+        self._given_key = key
+        key = (lambda x: x) if key is None else key
+        self._key = key
+        decorated = sorted((key(item), item) for item in iterable)
+        self._build([k for k, item in decorated], [item for k, item in decorated])
+
+    def _build(self, keys, items):
+        'Chunk the flat sorted lists of keys and items'
+        load = self._load
+        self._kl = [keys[i:i+load] for i in range(0, len(keys), load)]
+        self._il = [items[i:i+load] for i in range(0, len(items), load)]
+        self._maxes = [keys[-1] for keys in self._kl]
+        self._len = len(keys)
+        self._index()
+
+    def _index(self):
+        'Rebuild the Fenwick tree of sublist lengths'
+        tree = [0] + [len(keys) for keys in self._kl]
+        for i in range(1, len(tree)):
+            j = i + (i & -i)
+            if j < len(tree):
+                tree[j] += tree[i]
+        self._tree = tree
+
+    def _grow(self, b, delta):
+        'Add delta to the length of sublist b'
+        tree = self._tree
+        b += 1
+        while b < len(tree):
+            tree[b] += delta
+            b += b & -b
+        self._len += delta
+
+    def _offset(self, b):
+        'Return the position of the first item of sublist b'
+        tree = self._tree
+        total = 0
+        while b:
+            total += tree[b]
+            b -= b & -b
+        return total
+
+    def _locate(self, i):
+        'Return the sublist and its offset of position i'
+        tree = self._tree
+        size = len(tree)
+        b = 0
+        step = 1 << (size.bit_length() - 1)
+        while step:
+            j = b + step
+            if j < size and tree[j] <= i:
+                b = j
+                i -= tree[j]
+            step >>= 1
+        return b, i
+
+    def _bisect_left(self, k):
+        b = bisect_left(self._maxes, k)
+        if b == len(self._maxes):
+            return self._len
+        return self._offset(b) + bisect_left(self._kl[b], k)
+
+    def _bisect_right(self, k):
+        b = bisect_right(self._maxes, k)
+        if b == len(self._maxes):
+            return self._len
+        return self._offset(b) + bisect_right(self._kl[b], k)
+
+    def _slice(self, i, j):
+        'Iterate over the items from position i to before j'
+        if i >= j:
+            return
+        b, p = self._locate(i)
+        n = j - i
+        while n > 0:
+            items = self._il[b][p:p+n]
+            yield from items
+            n -= len(items)
+            b += 1
+            p = 0
+
+    def _insert(self, k, item, right):
+        if not self._maxes:
+            self._kl.append([k])
+            self._il.append([item])
+            self._maxes.append(k)
+            self._len = 1
+            self._index()
+            return
+        bisect = bisect_right if right else bisect_left
+        b = min(bisect(self._maxes, k), len(self._maxes) - 1)
+        self._own(b)
+        keys = self._kl[b]
+        i = bisect(keys, k)
+        keys.insert(i, k)
+        self._il[b].insert(i, item)
+        self._maxes[b] = keys[-1]
+        if len(keys) > 2 * self._load:
+            half = len(keys) // 2
+            items = self._il[b]
+            self._kl[b:b+1] = keys[:half], keys[half:]
+            self._il[b:b+1] = items[:half], items[half:]
+            self._maxes[b:b+1] = keys[half - 1], keys[-1]
+            self._len += 1
+            self._index()
+        else:
+            self._grow(b, 1)
+
+    def _delete(self, i, j):
+        'Remove the items from position i to before j'
+        if i >= j:
+            return
+        b0, p0 = self._locate(i)
+        b1, p1 = self._locate(j - 1)
+        for b in range(b1, b0 - 1, -1):
+            start = p0 if b == b0 else 0
+            stop = p1 + 1 if b == b1 else len(self._kl[b])
+            self._own(b)
+            del self._kl[b][start:stop]
+            del self._il[b][start:stop]
+            if self._kl[b]:
+                self._maxes[b] = self._kl[b][-1]
+            else:
+                del self._kl[b], self._il[b], self._maxes[b]
+        if b0 == b1 and len(self._kl) == len(self._tree) - 1 and len(self._kl[b0]) >= self._load // 2:
+            self._grow(b0, i - j)
+        else:
+            self._len -= j - i
+            if self._kl:
+                self._balance(min(b0, len(self._kl) - 1))
+            self._index()
+
+    def _balance(self, b):
+        'Merge sublist b into a neighbour if it has shrunk below half the load'
+        if len(self._kl) < 2 or len(self._kl[b]) >= self._load // 2:
+            return
+        if b == len(self._kl) - 1:
+            b -= 1
+        keys = self._kl[b] + self._kl[b+1]
+        items = self._il[b] + self._il[b+1]
+        if len(keys) > 2 * self._load:
+            half = len(keys) // 2
+            self._kl[b:b+2] = keys[:half], keys[half:]
+            self._il[b:b+2] = items[:half], items[half:]
+            self._maxes[b:b+2] = keys[half - 1], keys[-1]
+        else:
+            self._kl[b:b+2] = [keys]
+            self._il[b:b+2] = [items]
+            self._maxes[b:b+2] = [keys[-1]]
+
+    def _fork(self):
+        'Return a copy sharing the sublists, which it copies before changing'
+        new = self.__class__.__new__(self.__class__)
+        new._given_key = self._given_key
+        new._key = self._key
+        new._load = self._load
+        new._kl = list(self._kl)
+        new._il = list(self._il)
+        new._maxes = list(self._maxes)
+        new._tree = list(self._tree)
+        new._len = self._len
+        new._owned = set()
+        return new
+
+    def _own(self, b):
+        'Copy sublist b before it is changed if it is shared with a fork'
+        owned = self._owned
+        if owned is not None and id(self._kl[b]) not in owned:
+            self._kl[b] = list(self._kl[b])
+            self._il[b] = list(self._il[b])
+            owned.add(id(self._kl[b]))
+
+    @property
+    def load(self):
+        'the target sublist size'
+        return self._load
+
+    @property
+    def _keys(self):
+        return [k for keys in self._kl for k in keys]
+
+    @property
+    def _items(self):
+        return [item for items in self._il for item in items]
+
+    def copy(self):
+        return self.__class__(self, self._key, self._load)
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self._len)
+            if step == 1:
+                return list(self._slice(start, stop))
+            return [self[p] for p in range(start, stop, step)]
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError('%s index out of range' % self.__class__.__name__)
+        b, p = self._locate(i)
+        return self._il[b][p]
+
+    def __iter__(self):
+        return chain.from_iterable(self._il)
+
+    def __reversed__(self):
+        return chain.from_iterable(map(reversed, reversed(self._il)))
+
+    def __reduce__(self):
+        return self.__class__, (self._items, self._given_key, self._load)
+
+    def _find(self, item):
+        'Return the sublist and offset of the first occurence of item'
+        k = self._key(item)
+        b = bisect_left(self._maxes, k)
+        while b < len(self._maxes):
+            keys = self._kl[b]
+            items = self._il[b]
+            p = bisect_left(keys, k)
+            while p < len(keys) and keys[p] == k:
+                if items[p] == item:
+                    return b, p
+                p += 1
+            if p < len(keys):
+                break
+            b += 1
+        raise ValueError('%r not in %s' % (item, self.__class__.__name__))
+
+    def __contains__(self, item):
+        try:
+            self._find(item)
+        except ValueError:
+            return False
+        return True
+
+    def index(self, item):
+        'Find the position of an item.  Raise ValueError if not found.'
+        b, p = self._find(item)
+        return self._offset(b) + p
+
+    def count(self, item):
+        'Return number of occurrences of item'
+        k = self._key(item)
+        return sum(1 for x in self._slice(self._bisect_left(k), self._bisect_right(k)) if x == item)
+
+    def insert(self, item):
+        'Insert a new item.  If equal keys are found, add to the left'
+        self._insert(self._key(item), item, False)
+
+    def insert_right(self, item):
+        'Insert a new item.  If equal keys are found, add to the right'
+        self._insert(self._key(item), item, True)
+
+    def remove(self, item):
+        'Remove first occurence of item.  Raise ValueError if not found'
+        b, p = self._find(item)
+        self._own(b)
+        keys = self._kl[b]
+        del keys[p], self._il[b][p]
+        if keys and len(keys) >= self._load // 2:
+            self._maxes[b] = keys[-1]
+            self._grow(b, -1)
+            return
+        if keys:
+            self._maxes[b] = keys[-1]
+        else:
+            del self._kl[b], self._il[b], self._maxes[b]
+        self._len -= 1
+        if self._kl:
+            self._balance(min(b, len(self._kl) - 1))
+        self._index()
+
+    def update(self, iterable):
+        'Insert a batch of items.  If equal keys are found, add to the right'
+        key = self._key
+        new = sorted(((key(item), item) for item in iterable), key=itemgetter(0))
+        if len(new) * 16 < self._len:
+            for k, item in new:
+                self._insert(k, item, True)
+            return
+        decorated = list(merge(zip(self._keys, self._items), new, key=itemgetter(0)))
+        self._build([k for k, item in decorated], [item for k, item in decorated])
+
+    insert_many = update
+
+    def remove_many(self, iterable):
+        'Remove one occurence of each item.  Raise ValueError if any is not found'
+        drop = set()
+        for item in iterable:
+            k = self._key(item)
+            i = self._bisect_left(k)
+            for p, x in enumerate(self._slice(i, self._bisect_right(k)), i):
+                if p not in drop and x == item:
+                    drop.add(p)
+                    break
+            else:
+                raise ValueError('%r not in %s' % (item, self.__class__.__name__))
+        if len(drop) * 16 < self._len:
+            for p in sorted(drop, reverse=True):
+                self._delete(p, p + 1)
+        elif drop:
+            keys = [k for p, k in enumerate(self._keys) if p not in drop]
+            items = [item for p, item in enumerate(self._items) if p not in drop]
+            self._build(keys, items)
+
+    def _range(self, lo, hi, inclusive):
+        'Return the positions bounding the keys from lo to hi'
+        left, right = inclusive
+        if lo is None:
+            i = 0
+        else:
+            i = self._bisect_left(lo) if left else self._bisect_right(lo)
+        if hi is None:
+            j = self._len
+        else:
+            j = self._bisect_right(hi) if right else self._bisect_left(hi)
+        return i, max(i, j)
+
+    def irange(self, lo=None, hi=None, inclusive=(True, True)):
+        'Iterate over the items with keys between lo and hi.  None is unbounded'
+        return self._slice(*self._range(lo, hi, inclusive))
+
+    def remove_range(self, lo=None, hi=None, inclusive=(True, True)):
+        'Remove all items with keys between lo and hi.  None is unbounded'
+        self._delete(*self._range(lo, hi, inclusive))
+
+    def _before(self, b, p):
+        'Return the item before offset p of sublist b, or None for the first'
+        if p:
+            return self._il[b][p-1],
+        if b:
+            return self._il[b-1][-1],
+
+    def find(self, k):
+        'Return first item with a key == k.  Raise ValueError if not found.'
+        b = bisect_left(self._maxes, k)
+        if b != len(self._maxes):
+            keys = self._kl[b]
+            p = bisect_left(keys, k)
+            if keys[p] == k:
+                return self._il[b][p]
+        raise ValueError('No item found with key equal to: %r' % (k,))
+
+    def find_le(self, k):
+        'Return last item with a key <= k.  Raise ValueError if not found.'
+        b = bisect_right(self._maxes, k)
+        found = self._before(b, bisect_right(self._kl[b], k) if b != len(self._maxes) else 0)
+        if found:
+            return found[0]
+        raise ValueError('No item found with key at or below: %r' % (k,))
+
+    def find_lt(self, k):
+        'Return last item with a key < k.  Raise ValueError if not found.'
+        b = bisect_left(self._maxes, k)
+        found = self._before(b, bisect_left(self._kl[b], k) if b != len(self._maxes) else 0)
+        if found:
+            return found[0]
+        raise ValueError('No item found with key below: %r' % (k,))
+
+    def find_ge(self, k):
+        'Return first item with a key >= equal to k.  Raise ValueError if not found'
+        b = bisect_left(self._maxes, k)
+        if b != len(self._maxes):
+            return self._il[b][bisect_left(self._kl[b], k)]
+        raise ValueError('No item found with key at or above: %r' % (k,))
+
+    def find_gt(self, k):
+        'Return first item with a key > k.  Raise ValueError if not found'
+        b = bisect_right(self._maxes, k)
+        if b != len(self._maxes):
+            return self._il[b][bisect_right(self._kl[b], k)]
+        raise ValueError('No item found with key above: %r' % (k,))
+
+
+# the Python type of the scalars of each NumPy dtype kind
+_SCALAR_TYPES = {'b': bool, 'i': int, 'u': int, 'f': float}
+
+
+def _objects(items):
+    'Return a 1-d object array of items, even if they are sequences'
+    return np.fromiter(items, dtype=object, count=len(items))
+
+
+def _permute(items, order):
+    'Reorder the list in place as [items[i] for i in order], using up order'
+    # follow each cycle of the permutation, marking the done positions
+    # as fixed points of order
+    done = memoryview(order)
+    for start in range(len(items)):
+        if done[start] == start:
+            continue
+        first = items[start]
+        i = start
+        while True:
+            j = done[i]
+            done[i] = i
+            if j == start:
+                items[i] = first
+                break
+            items[i] = items[j]
+            i = j
+
+
+class NumericSortedCollection(SortedCollection):
+    '''SortedCollection with numeric keys stored in a NumPy array.
+
+    The keys are kept in a contiguous array so that many probes can be
+    answered by one ``np.searchsorted`` call instead of a Python-level
+    bisect per probe.  The ``*_many`` methods take an array of probe keys
+    and return arrays of positions or items; the rest of the API is that of
+    SortedCollection.  Insertion and removal copy the key array and are
+    O(n) like the list-based class, so build the collection in bulk with
+    the constructor or update().
+
+    Items with equal keys are kept in insertion order rather than being
+    ordered by the items themselves, so the items need not be comparable.
+
+    It is also the compact storage mode for large collections: the keys
+    are held once in a typed buffer instead of as Python objects, the
+    collection is sorted through an argsort permutation instead of a list
+    of (key, item) tuples, and re-keying sorts the existing item list in
+    place.  Give ``dtype`` to compute the keys straight into the buffer.
+
+    Parameters
+    ----------
+    iterable : iterable
+        the initial items.
+    key : callable or None
+        the key function. It must return numbers.
+    dtype : numpy dtype or None
+        the dtype of the key array. Default to the one inferred by NumPy.
+        Either is promoted when a key of a wider type is inserted.
+
+    Examples
+    --------
+    >>> from operator import itemgetter
+    >>> genes = NumericSortedCollection(
+    ...     [('dnaA', 1), ('dnaN', 1717), ('recF', 2845), ('gyrB', 4073)],
+    ...     key=itemgetter(1))
+    >>> genes.bisect_right_many([0, 1, 3000, 5000])
+    array([0, 1, 3, 4])
+    >>> genes.find_le_many([0, 2000, 5000]).tolist()
+    [None, ('dnaN', 1717), ('gyrB', 4073)]
+    >>> genes.find_ge(2000)
+    ('recF', 2845)
+    >>> s = NumericSortedCollection([3, 1, 2])
+    >>> s.find_gt_many([0, 2.5, 3], default=-1)
+    array([ 1,  3, -1])
+
+    '''
+    __slots__ = ('_dtype', '_values')
+
+    def __init__(self, iterable=(), key=None, dtype=None):
+        self._given_key = key
+        self._dtype = dtype
+        self._key = (lambda x: x) if key is None else key
+        self._keys = None
+        self._items = list(iterable)
+        self._sort()
+
+    def _sort(self):
+        'Compute the keys of the items and sort both by key'
+        items = self._items
+        if self._dtype is None:
+            keys = self._as_keys([self._key(item) for item in items])
+        else:
+            # no intermediate list of keys when the dtype is known
+            keys = self._as_keys(np.fromiter(map(self._key, items), self._dtype, count=len(items)), self._dtype)
+        order = np.argsort(keys, kind='stable')
+        keys.sort()
+        self._keys = keys
+        # permute the items in place so no second list of them is built
+        _permute(items, order)
+        self._values = None
+
+    @staticmethod
+    def _as_keys(keys, dtype=None):
+        keys = np.asarray(keys, dtype=dtype)
+        if keys.size == 0 and dtype is None:
+            keys = keys.astype(float)
+        if keys.dtype.kind not in 'iufb':
+            raise TypeError('Keys must be numeric, not %s' % keys.dtype)
+        return keys
+
+    def _setkey(self, key):
+        if key is not self._key:
+            self._given_key = key
+            self._key = (lambda x: x) if key is None else key
+            # drop the old keys before computing the new ones
+            self._keys = self._values = None
+            self._sort()
+
+    key = property(SortedCollection._getkey, _setkey, SortedCollection._delkey, 'key function')
+
+    def clear(self):
+        self.__init__([], self._given_key, self._dtype)
+
+    def _promote(self, keys):
+        'Convert keys to an array and widen the stored keys to hold them'
+        keys = self._as_keys(keys)
+        if not len(keys):
+            return keys
+        if not len(self._keys) and self._dtype is None:
+            # the float dtype of no keys must not round the first keys
+            dtype = keys.dtype
+        else:
+            dtype = np.result_type(self._keys, keys)
+        if dtype != self._keys.dtype:
+            self._keys = self._keys.astype(dtype)
+            if self._dtype is not None:
+                self._dtype = dtype
+        return keys
+
+    def _item_values(self):
+        'Return the items as an array, cached until the next change'
+        if self._values is None:
+            # without a key function the key array holds the items
+            # themselves if they all are scalars of its kind
+            dtype = self._keys.dtype
+            if (self._given_key is None and
+                    set(map(type, self._items)) <= {dtype.type, _SCALAR_TYPES.get(dtype.kind)}):
+                self._values = self._keys
+            else:
+                self._values = _objects(self._items)
+        return self._values
+
+    def copy(self):
+        return self.__class__(self, self._given_key, self._dtype)
+
+    def __reduce__(self):
+        return self.__class__, (self._items, self._given_key, self._dtype)
+
+    def insert(self, item):
+        'Insert a new item.  If equal keys are found, add to the left'
+        k = self._key(item)
+        self._promote([k])
+        i = bisect_left(self._keys, k)
+        self._keys = np.insert(self._keys, i, k)
+        self._items.insert(i, item)
+        self._values = None
+
+    def insert_right(self, item):
+        'Insert a new item.  If equal keys are found, add to the right'
+        k = self._key(item)
+        self._promote([k])
+        i = bisect_right(self._keys, k)
+        self._keys = np.insert(self._keys, i, k)
+        self._items.insert(i, item)
+        self._values = None
+
+    def remove(self, item):
+        'Remove first occurence of item.  Raise ValueError if not found'
+        i = self.index(item)
+        self._keys = np.delete(self._keys, i)
+        del self._items[i]
+        self._values = None
+
+    def remove_many(self, iterable):
+        'Remove one occurence of each item.  Raise ValueError if any is not found'
+        positions = sorted(self._positions(iterable))
+        self._keys = np.delete(self._keys, positions)
+        self._items = np.delete(_objects(self._items), positions).tolist()
+        self._values = None
+
+    def update(self, iterable):
+        'Insert a batch of items.  If equal keys are found, add to the right'
+        new = list(iterable)
+        keys = self._promote([self._key(item) for item in new])
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        # new item i goes after the i earlier new items and the old keys <= it
+        at = np.searchsorted(self._keys, keys, side='right') + np.arange(len(keys))
+        is_new = np.zeros(len(self) + len(keys), dtype=bool)
+        is_new[at] = True
+        merged = np.empty(len(is_new), dtype=self._keys.dtype)
+        merged[at] = keys
+        merged[~is_new] = self._keys
+        items = np.empty(len(is_new), dtype=object)
+        items[at] = _objects([new[i] for i in order])
+        items[~is_new] = _objects(self._items)
+        self._keys = merged
+        self._items = items.tolist()
+        self._values = None
+
+    insert_many = update
+
+    def remove_range(self, lo=None, hi=None, inclusive=(True, True)):
+        'Remove all items with keys between lo and hi.  None is unbounded'
+        i, j = self._range(lo, hi, inclusive)
+        self._keys = np.concatenate([self._keys[:i], self._keys[j:]])
+        del self._items[i:j]
+        self._values = None
+
+    def bisect_left_many(self, ks):
+        'Return the positions to insert each of ks to the left of equal keys'
+        return np.searchsorted(self._keys, ks, side='left')
+
+    def bisect_right_many(self, ks):
+        'Return the positions to insert each of ks to the right of equal keys'
+        return np.searchsorted(self._keys, ks, side='right')
+
+    def _take(self, positions, found, default):
+        'Return the items at positions, or default where not found'
+        values = self._item_values()
+        if not len(values):
+            return np.full(len(positions), default)
+        out = values[np.where(found, positions, 0)]
+        if not found.all():
+            out = np.where(found, out, default)
+        return out
+
+    def find_le_many(self, ks, default=None):
+        'Return the last item with a key <= each of ks, or default if none'
+        i = self.bisect_right_many(ks) - 1
+        return self._take(i, i >= 0, default)
+
+    def find_lt_many(self, ks, default=None):
+        'Return the last item with a key < each of ks, or default if none'
+        i = self.bisect_left_many(ks) - 1
+        return self._take(i, i >= 0, default)
+
+    def find_ge_many(self, ks, default=None):
+        'Return the first item with a key >= each of ks, or default if none'
+        i = self.bisect_left_many(ks)
+        return self._take(i, i < len(self), default)
+
+    def find_gt_many(self, ks, default=None):
+        'Return the first item with a key > each of ks, or default if none'
+        i = self.bisect_right_many(ks)
+        return self._take(i, i < len(self), default)
+
+    def count_range_many(self, lo, hi, inclusive=(True, True)):
+        'Return number of items with keys between each pair of lo and hi'
+        left, right = inclusive
+        i = np.searchsorted(self._keys, lo, side='left' if left else 'right')
+        j = np.searchsorted(self._keys, hi, side='right' if right else 'left')
+        return np.maximum(j - i, 0)
+
+
+class ConcurrentSortedCollection:
+    '''Thread-safe SortedCollection whose readers never block.
+
+    The collection is held as a ChunkedSortedCollection version that is
+    never changed once published.  Reads go to the current version
+    without taking a lock, so each read sees a consistent state;
+    snapshot() returns the version itself for several reads that must
+    agree.  Writes are queued and applied by one writer at a time: the
+    thread holding the write lock applies every queued write to a fork of
+    the current version, which shares the unchanged sublists and copies
+    the ones it changes, and then publishes the fork with a single
+    assignment.  Each write call returns once it is visible and raises
+    its own error, if any; a failed write is not applied at all.
+
+    Parameters
+    ----------
+    iterable : iterable
+        the initial items.
+    key : callable or None
+        the key function.
+    load : int or None
+        the target sublist size of the ChunkedSortedCollection.
+
+    Examples
+    --------
+    >>> s = ConcurrentSortedCollection([5, 1, 3])
+    >>> s.insert(2)
+    >>> snap = s.snapshot()
+    >>> s.remove_many([1, 5])
+    >>> list(snap), list(s), s.find_le(4)
+    ([1, 2, 3, 5], [2, 3], 3)
+
+    '''
+    def __init__(self, iterable=(), key=None, load=None):
+        self._version = ChunkedSortedCollection(iterable, key, load)
+        self._queue = []
+        self._queue_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def snapshot(self):
+        'Return the current version, which is never changed'
+        return self._version
+
+    def _write(self, method, *args):
+        'Queue a write and wait until it is applied in a batch'
+        # [method, args, applied, error]
+        op = [method, args, False, None]
+        with self._queue_lock:
+            self._queue.append(op)
+        with self._write_lock:
+            if not op[2]:
+                with self._queue_lock:
+                    batch, self._queue = self._queue, []
+                version = self._version._fork()
+                done = []
+                for o in batch:
+                    try:
+                        o[0](version, *o[1])
+                        done.append(o)
+                    except Exception as e:
+                        o[3] = e
+                        # the failed write may have changed the fork in
+                        # part; fork again and replay the writes before it
+                        version = self._version._fork()
+                        for d in done:
+                            d[0](version, *d[1])
+                    o[2] = True
+                self._version = version
+        if op[3] is not None:
+            raise op[3]
+
+    def _getkey(self):
+        return self._version.key
+
+    def _setkey(self, key):
+        self._write(ChunkedSortedCollection._setkey, key)
+
+    def _delkey(self):
+        self._setkey(None)
+
+    key = property(_getkey, _setkey, _delkey, 'key function')
+
+    def insert(self, item):
+        'Insert a new item.  If equal keys are found, add to the left'
+        self._write(ChunkedSortedCollection.insert, item)
+
+    def insert_right(self, item):
+        'Insert a new item.  If equal keys are found, add to the right'
+        self._write(ChunkedSortedCollection.insert_right, item)
+
+    def remove(self, item):
+        'Remove first occurence of item.  Raise ValueError if not found'
+        self._write(ChunkedSortedCollection.remove, item)
+
+    def update(self, iterable):
+        'Insert a batch of items.  If equal keys are found, add to the right'
+        self._write(ChunkedSortedCollection.update, list(iterable))
+
+    insert_many = update
+
+    def remove_many(self, iterable):
+        'Remove one occurence of each item.  Raise ValueError if any is not found'
+        self._write(ChunkedSortedCollection.remove_many, list(iterable))
+
+    def remove_range(self, lo=None, hi=None, inclusive=(True, True)):
+        'Remove all items with keys between lo and hi.  None is unbounded'
+        self._write(ChunkedSortedCollection.remove_range, lo, hi, inclusive)
+
+    def clear(self):
+        self._write(ChunkedSortedCollection.clear)
+
+    def copy(self):
+        return self.__class__(self._version, self._version._given_key, self._version.load)
+
+    def __len__(self):
+        return len(self._version)
+
+    def __getitem__(self, i):
+        return self._version[i]
+
+    def __iter__(self):
+        return iter(self._version)
+
+    def __reversed__(self):
+        return reversed(self._version)
+
+    def __contains__(self, item):
+        return item in self._version
+
+    def __repr__(self):
+        return '%s%s' % (self.__class__.__name__, repr(self._version)[len('ChunkedSortedCollection'):])
+
+    def __reduce__(self):
+        version = self._version
+        return self.__class__, (version._items, version._given_key, version.load)
+
+    def index(self, item):
+        'Find the position of an item.  Raise ValueError if not found.'
+        return self._version.index(item)
+
+    def count(self, item):
+        'Return number of occurrences of item'
+        return self._version.count(item)
+
+    def find(self, k):
+        'Return first item with a key == k.  Raise ValueError if not found.'
+        return self._version.find(k)
+
+    def find_le(self, k):
+        'Return last item with a key <= k.  Raise ValueError if not found.'
+        return self._version.find_le(k)
+
+    def find_lt(self, k):
+        'Return last item with a key < k.  Raise ValueError if not found.'
+        return self._version.find_lt(k)
+
+    def find_ge(self, k):
+        'Return first item with a key >= equal to k.  Raise ValueError if not found'
+        return self._version.find_ge(k)
+
+    def find_gt(self, k):
+        'Return first item with a key > k.  Raise ValueError if not found'
+        return self._version.find_gt(k)
+
+    def irange(self, lo=None, hi=None, inclusive=(True, True)):
+        'Iterate over the items with keys between lo and hi.  None is unbounded'
+        return self._version.irange(lo, hi, inclusive)
+
+    def count_range(self, lo=None, hi=None, inclusive=(True, True)):
+        'Return number of items with keys between lo and hi.  None is unbounded'
+        return self._version.count_range(lo, hi, inclusive)
+
+
+_SNAPSHOT_MAGIC = b'SCSNAP01'
+_SNAPSHOT_HEADER = struct.Struct('<8s8sQ')
+
+
+def _align(offset, size=8):
+    return -(-offset // size) * size
+
+
+class _SnapshotItems:
+    'Read-only sequence unpickling the items of a snapshot on demand'
+
+    __slots__ = ('_mmap', '_offsets', '_start')
+
+    def __init__(self, mm, offsets, start):
+        self._mmap = mm
+        self._offsets = offsets
+        self._start = start
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('snapshot index out of range')
+        start = self._start + int(self._offsets[i])
+        stop = self._start + int(self._offsets[i + 1])
+        return pickle.loads(self._mmap[start:stop])
+
+    def __iter__(self):
+        return map(self.__getitem__, range(len(self)))
+
+
+class SortedSnapshot(NumericSortedCollection):
+    '''Read-only SortedCollection memory-mapped from a file written by save().
+
+    The file holds the sorted key array, the offsets of the items and the
+    pickled items.  Opening it maps the file and takes array views of the
+    keys and offsets, so there is no sort and nothing is loaded up front;
+    the finding, indexing, slicing and ``*_many`` methods bisect the mapped
+    keys and unpickle only the items they return.  Processes opening the
+    same file share its pages through the page cache, and pickling a
+    snapshot only sends its file name.
+
+    The key function is not saved.  Give the one the collection was sorted
+    by for the methods that take items, i.e. ``index``, ``count`` and ``in``.
+    Methods that change the collection raise TypeError; ``copy()`` returns
+    a NumericSortedCollection loaded in memory.
+
+    Parameters
+    ----------
+    filename : str
+        the snapshot file.
+    key : callable or None
+        the key function the collection was sorted by.
+
+    Examples
+    --------
+    >>> import os
+    >>> from operator import itemgetter
+    >>> from tempfile import TemporaryDirectory
+    >>> s = SortedCollection([('c', 3), ('a', 1), ('b', 2)], key=itemgetter(1))
+    >>> with TemporaryDirectory() as d:
+    ...     fp = os.path.join(d, 'genes.snap')
+    ...     s.save(fp)
+    ...     snap = SortedSnapshot(fp, key=itemgetter(1))
+    ...     snap.find_ge(1.5), snap.index(('c', 3)), snap[:2], len(snap)
+    (('b', 2), 2, [('a', 1), ('b', 2)], 3)
+
+    '''
+    __slots__ = ('_filename',)
+
+    def __init__(self, filename, key=None):
+        self._filename = filename
+        self._given_key = key
+        self._key = (lambda x: x) if key is None else key
+        self._dtype = None
+        self._values = None
+        with open(filename, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, dtype, n = _SNAPSHOT_HEADER.unpack_from(mm)
+        if magic != _SNAPSHOT_MAGIC:
+            raise ValueError('Not a SortedCollection snapshot: %s' % filename)
+        dtype = np.dtype(dtype.rstrip(b'\0').decode())
+        keys_start = _SNAPSHOT_HEADER.size
+        offsets_start = _align(keys_start + dtype.itemsize * n)
+        # the mapping stays open as long as these views are referenced
+        self._keys = np.frombuffer(mm, dtype=dtype, count=n, offset=keys_start)
+        offsets = np.frombuffer(mm, dtype='<u8', count=n + 1, offset=offsets_start)
+        self._items = _SnapshotItems(mm, offsets, offsets_start + 8 * (n + 1))
+
+    def __repr__(self):
+        return '%s(%r, key=%s)' % (
+            self.__class__.__name__,
+            self._filename,
+            getattr(self._given_key, '__name__', repr(self._given_key)))
+
+    def __reduce__(self):
+        return self.__class__, (self._filename, self._given_key)
+
+    def copy(self):
+        return NumericSortedCollection(self, self._given_key)
+
+    def _take(self, positions, found, default):
+        'Return the items at positions, or default where not found'
+        items = self._items
+        return _objects([items[i] if ok else default
+                         for i, ok in zip(positions.tolist(), found.tolist())])
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('%s is read-only' % self.__class__.__name__)
+
+    insert = insert_right = remove = update = insert_many = remove_many = remove_range = clear = _read_only
+    key = property(SortedCollection._getkey, _read_only, _read_only, 'key function')
+
+
 # ---------------------------  Simple demo and tests  -------------------------
 if __name__ == '__main__':
 
@@ -313,5 +1403,387 @@ if __name__ == '__main__':
     sd.remove('jumped')
     assert list(sd) == ['Brown', 'Fox', 'jUmPeD', 'quick', 'QuIcK', 'The']
 
+    from random import random, randrange
+    for n in (0, 5, 100):
+        for m in (0, 3, 50):
+            s = [randrange(20) for i in range(n)]
+            t = [randrange(20) for i in range(m)]
+            sc = SortedCollection(s)
+            sc.update(t)                                # test update()
+            assert list(sc) == sorted(s + t)
+            assert sc._keys == list(sc)
+            for lo in (None, -1, 0, 5, 10.5, 25):
+                for hi in (None, -1, 5, 10, 19):
+                    for inclusive in ((True, True), (False, True), (True, False), (False, False)):
+                        expect = [x for x in sorted(s + t)
+                                  if (lo is None or (x >= lo if inclusive[0] else x > lo)) and
+                                  (hi is None or (x <= hi if inclusive[1] else x < hi))]
+                        assert list(sc.irange(lo, hi, inclusive)) == expect
+                        assert sc.count_range(lo, hi, inclusive) == len(expect)
+            sc.remove_many(t)                           # test remove_many()
+            assert list(sc) == sorted(s)
+            assert sc._keys == list(sc)
+            sc.remove_range(5, 10)                      # test remove_range()
+            assert list(sc) == [x for x in sorted(s) if not 5 <= x <= 10]
+    sd = SortedCollection(key=str.lower)
+    sd.update(['b', 'A', 'a', 'c'])
+    sd.update(['B', 'C', 'b', 'x', 'y', 'z', 'a', 'A', 'd'])
+    assert list(sd) == ['A', 'a', 'a', 'A', 'b', 'B', 'b', 'c', 'C', 'd', 'x', 'y', 'z']
+    sd.remove_many(['a', 'a', 'b'])
+    assert list(sd) == ['A', 'A', 'B', 'b', 'c', 'C', 'd', 'x', 'y', 'z']
+    try:
+        sd.remove_many(['A', 'A', 'A'])
+    except ValueError:
+        pass
+    else:
+        assert 0, 'Oops, failed to notify of missing value'
+    assert len(sd) == 10
+    sc = SortedCollection(random() for i in range(1000))
+    assert sc.count_range(0.25, 0.75) == sum(1 for x in sc if 0.25 <= x <= 0.75)
+
+    # ChunkedSortedCollection against SortedCollection with tiny sublists
+    from random import seed, shuffle
+    seed(0)
+    for load in (1, 2, 3, 8):
+        for n in (0, 1, 10, 200):
+            s = [randrange(50) for i in range(n)]
+            sc = SortedCollection(s, key=lambda x: x // 2)
+            cc = ChunkedSortedCollection(s, key=lambda x: x // 2, load=load)
+            for step in range(300):
+                op = randrange(7)
+                x = randrange(60)
+                if op == 0:
+                    sc.insert(x)
+                    cc.insert(x)
+                elif op == 1:
+                    sc.insert_right(x)
+                    cc.insert_right(x)
+                elif op == 2 and x in sc:
+                    sc.remove(x)
+                    cc.remove(x)
+                elif op == 3:
+                    t = [randrange(60) for i in range(randrange(20))]
+                    sc.update(t)
+                    cc.update(t)
+                elif op == 4:
+                    t = list(sc)[::3]
+                    shuffle(t)
+                    sc.remove_many(t)
+                    cc.remove_many(t)
+                elif op == 5:
+                    sc.remove_range(x // 2, x // 2 + 2)
+                    cc.remove_range(x // 2, x // 2 + 2)
+                assert list(cc) == list(sc), (load, n, step, op)
+                assert cc._keys == sc._keys
+                assert len(cc) == len(sc) == cc._offset(len(cc._kl))
+                assert all(cc._kl) and cc._maxes == [keys[-1] for keys in cc._kl]
+                assert list(reversed(cc)) == list(reversed(sc))
+            for k in range(-1, 32):
+                assert repr(ve2no(cc.find, k)) == repr(ve2no(sc.find, k))
+                assert repr(ve2no(cc.find_le, k)) == repr(ve2no(sc.find_le, k))
+                assert repr(ve2no(cc.find_lt, k)) == repr(ve2no(sc.find_lt, k))
+                assert repr(ve2no(cc.find_ge, k)) == repr(ve2no(sc.find_ge, k))
+                assert repr(ve2no(cc.find_gt, k)) == repr(ve2no(sc.find_gt, k))
+                assert list(cc.irange(k, k + 3)) == list(sc.irange(k, k + 3))
+                assert cc.count_range(k, k + 3, (False, False)) == sc.count_range(k, k + 3, (False, False))
+            for x in range(-1, 61):
+                assert (x in cc) == (x in sc)
+                assert cc.count(x) == sc.count(x)
+                assert repr(ve2no(cc.index, x)) == repr(ve2no(sc.index, x))
+            for i in range(-len(sc), len(sc)):
+                assert cc[i] == sc[i]
+            assert cc[3:-2] == sc[3:-2] and cc[::-3] == sc[::-3] and cc[5:1] == sc[5:1]
+            cc.key = sc.key = lambda x: -x
+            assert list(cc) == list(sc)
+            assert list(cc.copy()) == list(sc) and cc.copy().load == load
+
+    # NumericSortedCollection against SortedCollection
+    for n in (0, 1, 10, 200):
+        s = [randrange(50) for i in range(n)]
+        sc = SortedCollection(s)
+        nc = NumericSortedCollection(s, dtype=np.int64)
+        for step in range(100):
+            op = randrange(6)
+            x = randrange(60)
+            if op == 0:
+                sc.insert(x)
+                nc.insert(x)
+            elif op == 1:
+                sc.insert_right(x + 0.5)
+                nc.insert_right(x + 0.5)
+            elif op == 2 and x in sc:
+                sc.remove(x)
+                nc.remove(x)
+            elif op == 3:
+                t = [randrange(60) for i in range(randrange(20))]
+                sc.update(t)
+                nc.update(t)
+            elif op == 4:
+                t = list(sc)[::3]
+                sc.remove_many(t)
+                nc.remove_many(t)
+            elif op == 5:
+                sc.remove_range(x, x + 2)
+                nc.remove_range(x, x + 2)
+            assert list(nc) == list(sc) and list(nc._keys) == sc._keys
+        probes = np.arange(-1, 62) / 2
+        for name in ('find_le', 'find_lt', 'find_ge', 'find_gt'):
+            expect = [ve2no(getattr(sc, name), k) for k in probes]
+            assert getattr(nc, name + '_many')(probes, default=-1).tolist() == expect
+            assert [ve2no(getattr(nc, name), k) for k in probes] == expect
+        assert nc.bisect_left_many(probes).tolist() == [bisect_left(sc._keys, k) for k in probes]
+        assert nc.count_range_many(probes, probes + 3).tolist() == [sc.count_range(k, k + 3) for k in probes]
+        nc.key = sc.key = lambda x: -x
+        assert list(nc) == list(sc)
+    nc = NumericSortedCollection([('a', 2), ('b', 1), ('c', 2)], key=itemgetter(1))
+    nc.update([('d', 2), ('e', 0)])
+    assert list(nc) == [('e', 0), ('b', 1), ('a', 2), ('c', 2), ('d', 2)]
+    assert nc.find_ge_many([2, 3]).tolist() == [('a', 2), None]
+    mixed = NumericSortedCollection([1, 2])
+    mixed.insert(0.5)                               # promote the keys to float
+    assert [type(x) for x in mixed.find_le_many([0.5, 1.5]).tolist()] == [float, int]
+    assert type(mixed.find_le_many([2])[0]) is type(mixed.find_le(2)) is int
+    # large int keys are not rounded through float
+    ts = [1700000000000000001, 1700000000000000002, 1700000000000000003]
+    tc = NumericSortedCollection()
+    tc.update(ts)
+    assert tc._keys.dtype.kind == 'i' and tc.find_le(ts[0]) == ts[0]
+    assert tc.count_range(ts[1], ts[1]) == 1
+    tc = NumericSortedCollection()
+    tc.insert(ts[2])
+    tc.insert(ts[0])
+    assert tc.find_ge(ts[0] + 1) == ts[2]
+    tc = NumericSortedCollection([2**60 + 1, 2**60 + 3])
+    tc.update([])
+    assert tc._keys.dtype.kind == 'i' and tc.count_range(2**60 + 1, 2**60 + 1) == 1
+    items = nc._items
+    nc.key = lambda x: -x[1]                        # re-key in place
+    assert nc._items is items and nc[0] == ('a', 2) and nc[-1] == ('e', 0)
+    for cls in (SortedCollection, ChunkedSortedCollection, NumericSortedCollection):
+        assert not hasattr(cls(), '__dict__')
+    try:
+        NumericSortedCollection(['a'])
+    except TypeError:
+        pass
+    else:
+        assert 0, 'Oops, failed to reject non-numeric keys'
+
+    # SortedSnapshot against the collections it was saved from
+    import os
+    from tempfile import TemporaryDirectory
+    with TemporaryDirectory() as d:
+        fp = os.path.join(d, 'sc.snap')
+        for cls in (SortedCollection, ChunkedSortedCollection, NumericSortedCollection):
+            for n in (0, 1, 100):
+                sc = cls([(randrange(50), i) for i in range(n)], key=itemgetter(0))
+                sc.save(fp)
+                snap = SortedSnapshot(fp, key=itemgetter(0))
+                assert len(snap) == n and list(snap) == list(sc) and list(reversed(snap)) == list(reversed(sc))
+                assert pickle.loads(pickle.dumps(snap))[:] == sc[:] and list(snap.copy()) == list(sc)
+                for k in range(-1, 52):
+                    for name in ('find', 'find_le', 'find_lt', 'find_ge', 'find_gt'):
+                        assert ve2no(getattr(snap, name), k) == ve2no(getattr(sc, name), k)
+                    assert list(snap.irange(k, k + 5)) == list(sc.irange(k, k + 5))
+                for item in sc:
+                    assert snap.index(item) == sc.index(item) and item in snap
+                assert (51, 0) not in snap
+                assert snap[3:-3:2] == sc[3:-3:2]
+                probes = np.arange(-1, 52)
+                assert snap.find_le_many(probes, default=-1).tolist() == [ve2no(sc.find_le, k) for k in probes]
+        for method, args in ((snap.insert, [(1, 1)]), (snap.remove_many, [[]]), (snap.clear, [])):
+            try:
+                method(*args)
+            except TypeError:
+                pass
+            else:
+                assert 0, 'Oops, snapshot was changed'
+        with open(fp, 'wb') as f:
+            f.write(b'x' * 64)
+        try:
+            SortedSnapshot(fp)
+        except ValueError:
+            pass
+        else:
+            assert 0, 'Oops, failed to reject a bad snapshot'
+
+    # ConcurrentSortedCollection: snapshots never change and all writes land
+    for load in (2, 8):
+        cs = ConcurrentSortedCollection(range(0, 200, 2), load=load)
+        snaps = [(cs.snapshot(), list(cs))]
+        for step in range(200):
+            op = randrange(4)
+            x = randrange(200)
+            if op == 0:
+                cs.insert(x)
+            elif op == 1 and x in cs:
+                cs.remove(x)
+            elif op == 2:
+                cs.update([randrange(200) for i in range(randrange(30))])
+            elif op == 3:
+                cs.remove_range(x, x + 5)
+            snaps.append((cs.snapshot(), list(cs)))
+        for snap, items in snaps:
+            assert list(snap) == items and len(snap) == len(items)
+    try:
+        cs.remove(-1)
+    except ValueError:
+        pass
+    else:
+        assert 0, 'Oops, failed to notify of missing value'
+
+    cs = ConcurrentSortedCollection(load=16)
+    errors = []
+
+    def writer(w):
+        for i in range(300):
+            cs.insert((i, w))
+            if i % 3 == 0:
+                cs.remove((i, w))
+
+    def reader():
+        for i in range(300):
+            snap = cs.snapshot()
+            items = list(snap)
+            if items != sorted(items) or len(items) != len(snap) or items != snap[:]:
+                errors.append(items)
+
+    threads = [threading.Thread(target=writer, args=(w,)) for w in range(4)]
+    threads += [threading.Thread(target=reader) for w in range(4)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    assert not errors
+    assert list(cs) == sorted((i, w) for i in range(300) for w in range(4) if i % 3)
+    cs.key = lambda x: -x[0]
+    assert cs[0][0] == 299 and len(cs) == 800
+
+    # a failed write is not published, even in the middle of a batch
+    def bad_key(x):
+        if x == 2:
+            raise ValueError
+        return -x
+    cs = ConcurrentSortedCollection([3, 1, 2], load=2)
+    snap = cs.snapshot()
+    try:
+        cs.key = bad_key
+    except ValueError:
+        pass
+    else:
+        assert 0, 'Oops, failed to raise the key error'
+    assert cs.key is not bad_key and list(cs) == [1, 2, 3]
+    failed = [ChunkedSortedCollection._setkey, (bad_key,), False, None]
+    cs._queue.append(failed)
+    cs.insert(0)
+    assert failed[2] and isinstance(failed[3], ValueError)
+    assert cs.key is not bad_key and list(cs) == [0, 1, 2, 3] and list(snap) == [1, 2, 3]
+
     import doctest
     print(doctest.testmod())
+
+    # ---------------------------  Benchmark  ------------------------------
+    import sys
+    from timeit import default_timer
+
+    def benchmark(cls, n):
+        'Time random inserts, lookups and removals of n items'
+        data = [random() for i in range(n)]
+        times = []
+        sc = cls()
+        start = default_timer()
+        for x in data:
+            sc.insert(x)
+        times.append(default_timer() - start)
+        start = default_timer()
+        for x in data:
+            sc.find_ge(x)
+            sc[int(x * n)]
+        times.append(default_timer() - start)
+        start = default_timer()
+        for x in data:
+            sc.remove(x)
+        times.append(default_timer() - start)
+        return times
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print('%d items: %10s %10s %10s' % (n, 'insert', 'lookup', 'remove'))
+    for cls in (SortedCollection, ChunkedSortedCollection):
+        print('%-25s %9.2fs %9.2fs %9.2fs' % ((cls.__name__,) + tuple(benchmark(cls, n))))
+
+    data = np.random.random(n)
+    probes = np.random.random(n)
+    for cls in (SortedCollection, NumericSortedCollection):
+        sc = cls(data)
+        start = default_timer()
+        if cls is NumericSortedCollection:
+            sc.find_le_many(probes, default=-1)
+        else:
+            [ve2no(sc.find_le, x) for x in probes]
+        print('%-25s %9.2fs find_le of %d probes' % (cls.__name__, default_timer() - start, n))
+
+    class LockedSortedCollection(ChunkedSortedCollection):
+        'ChunkedSortedCollection with every method under one lock'
+        __slots__ = ('_lock',)
+
+        def __init__(self, *args, **kwargs):
+            self._lock = threading.Lock()
+            super().__init__(*args, **kwargs)
+
+        def insert(self, item):
+            with self._lock:
+                super().insert(item)
+
+        def remove(self, item):
+            with self._lock:
+                super().remove(item)
+
+        def find_le(self, k):
+            with self._lock:
+                return super().find_le(k)
+
+    def read_under_writes(sc, seconds=1, readers=4):
+        'Count find_le reads done while one thread inserts and removes'
+        stop = threading.Event()
+        reads = []
+
+        def read():
+            count = 0
+            while not stop.is_set():
+                for x in data[:100]:
+                    sc.find_le(x)
+                count += 100
+            reads.append(count)
+
+        def write():
+            while not stop.is_set():
+                for x in data[:100]:
+                    sc.insert(x + 1)
+                for x in data[:100]:
+                    sc.remove(x + 1)
+
+        threads = [threading.Thread(target=read) for i in range(readers)]
+        threads.append(threading.Thread(target=write))
+        for th in threads:
+            th.start()
+        stop.wait(seconds)
+        stop.set()
+        for th in threads:
+            th.join()
+        return sum(reads) / seconds
+
+    data = data.tolist()
+    for sc in (LockedSortedCollection(data), ConcurrentSortedCollection(data)):
+        print('%-25s %9.0f reads/s under writes' % (sc.__class__.__name__, read_under_writes(sc)))
+
+    with TemporaryDirectory() as d:
+        fp = os.path.join(d, 'sc.snap')
+        start = default_timer()
+        sc = NumericSortedCollection(data)
+        print('%-25s %9.2fs to build' % ('NumericSortedCollection', default_timer() - start))
+        sc.save(fp)
+        start = default_timer()
+        sc = SortedSnapshot(fp)
+        print('%-25s %9.2fs to open' % ('SortedSnapshot', default_timer() - start))
+        start = default_timer()
+        sc.find_le_many(probes[:1000], default=-1)
+        print('%-25s %9.2fs find_le of 1000 probes' % ('SortedSnapshot', default_timer() - start))
@@ -0,0 +1,254 @@
+'''
+Interval index answering point-stabbing and range-overlap queries.
+
+The intervals are sorted by start with a SortedCollection and laid out
+as an implicit augmented binary search tree over the sorted arrays, as
+in cgranges (https://github.com/lh3/cgranges): the node at index x has
+level k, the number of trailing 1 bits of x, and its children are
+x -/+ 2**(k-1).  Every node also stores the largest end in its subtree
+so that subtrees ending before the query are skipped. A query then takes
+O(log n + k) for k hits.
+'''
+
+from operator import itemgetter
+
+import numpy as np
+
+from recipes.bisect2 import NumericSortedCollection
+
+
+class IntervalIndex:
+    '''Index of half-open intervals [start, end) with payloads.
+
+    The index is built in bulk and is read-only. ``stab`` and
+    ``overlap`` answer one query with a Python loop over the tree;
+    ``stab_many`` and ``overlap_many`` answer an array of queries by
+    walking the tree one level at a time for all of them with NumPy, and
+    return the pairs of query and interval positions that hit.
+
+    Parameters
+    ----------
+    records : iterable of tuple
+        (start, end, payload) of each interval.
+
+    Attributes
+    ----------
+    starts, ends : numpy.ndarray
+        the intervals sorted by start. Positions returned by the
+        ``*_many`` methods index into them.
+    payloads : list
+        the payloads in the same order.
+
+    Examples
+    --------
+    >>> genes = IntervalIndex([(1, 1525, 'dnaA'), (1717, 2817, 'dnaN'),
+    ...                        (2845, 3922, 'recF'), (2000, 4000, 'ncRNA')])
+    >>> genes.stab(2500)
+    ['dnaN', 'ncRNA']
+    >>> genes.overlap(3900, 5000)
+    ['ncRNA', 'recF']
+    >>> genes.overlap(1525, 1717)
+    []
+    >>> q, i = genes.stab_many([0, 1, 2000, 2900])
+    >>> q.tolist(), [genes.payloads[j] for j in i]
+    ([1, 2, 2, 3, 3], ['dnaA', 'dnaN', 'ncRNA', 'ncRNA', 'recF'])
+    '''
+    def __init__(self, records=()):
+        sc = NumericSortedCollection(records, key=itemgetter(0))
+        self._set(sc._keys, [r[1] for r in sc], [r[2] for r in sc])
+
+    @classmethod
+    def from_arrays(cls, starts, ends, payloads=None):
+        '''Build the index from arrays of starts and ends.
+
+        Parameters
+        ----------
+        starts, ends : array_like
+            the starts and ends of the intervals.
+        payloads : sequence or None
+            the payloads of the intervals. Default to their positions
+            in the arrays.
+        '''
+        starts = np.asarray(starts)
+        ends = np.asarray(ends)
+        if len(starts) != len(ends):
+            raise ValueError('Intervals have different numbers of starts and ends')
+        if payloads is None:
+            payloads = range(len(starts))
+        order = np.argsort(starts, kind='stable')
+        index = cls.__new__(cls)
+        index._set(starts[order], ends[order], [payloads[i] for i in order])
+        return index
+
+    def _set(self, starts, ends, payloads):
+        'Store the intervals sorted by start and index them'
+        ends = np.asarray(ends)
+        if len(starts) != len(ends) or len(ends) != len(payloads):
+            raise ValueError('Intervals have different numbers of starts, ends and payloads')
+        dtype = np.result_type(starts, ends)
+        self.starts = starts.astype(dtype, copy=False)
+        self.ends = ends.astype(dtype, copy=False)
+        self.payloads = payloads
+        if (self.ends < self.starts).any():
+            raise ValueError('Interval end is less than its start')
+        self._index()
+
+    def _index(self):
+        'Compute the largest end of every subtree and the root level'
+        n = len(self.starts)
+        mx = self.ends.copy()
+        # the largest end of the last real node on the path to the root,
+        # which stands in for the missing right children past n
+        last_i = n - 1 if n % 2 else n - 2
+        last = mx[last_i] if n else 0
+        k = 1
+        while 1 << k <= n:
+            x = 1 << (k - 1)
+            i = np.arange((x << 1) - 1, n, x << 2)
+            right = i + x
+            er = np.full(len(i), last, dtype=mx.dtype)
+            real = right < n
+            er[real] = mx[right[real]]
+            mx[i] = np.maximum(np.maximum(mx[i], mx[i - x]), er)
+            last_i = last_i - x if last_i >> k & 1 else last_i + x
+            if last_i < n and mx[last_i] > last:
+                last = mx[last_i]
+            k += 1
+        self._max = mx
+        self._root = k - 1
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _query(self, st, en, point):
+        'Return the sorted positions of the intervals hitting the query'
+        n = len(self.starts)
+        if not n:
+            return []
+        starts, ends, mx = self.starts, self.ends, self._max
+        # a point x is hit by start <= x < end; a range by start < en and st < end
+        before = (lambda s: s <= en) if point else (lambda s: s < en)
+        out = []
+        stack = [(self._root, (1 << self._root) - 1, False)]
+        while stack:
+            k, x, left_done = stack.pop()
+            if k <= 3:
+                # a small subtree; scan its nodes in order
+                i0 = x >> k << k
+                for i in range(i0, min(i0 + (1 << (k + 1)) - 1, n)):
+                    if not before(starts[i]):
+                        break
+                    if st < ends[i]:
+                        out.append(i)
+            elif not left_done:
+                stack.append((k, x, True))
+                y = x - (1 << (k - 1))
+                if y >= n or mx[y] > st:
+                    stack.append((k - 1, y, False))
+            elif x < n and before(starts[x]):
+                if st < ends[x]:
+                    out.append(x)
+                stack.append((k - 1, x + (1 << (k - 1)), False))
+        return out
+
+    def stab(self, x):
+        '''Return the payloads of the intervals containing the point x.'''
+        return [self.payloads[i] for i in self._query(x, x, True)]
+
+    def overlap(self, start, end):
+        '''Return the payloads of the intervals overlapping [start, end).'''
+        return [self.payloads[i] for i in self._query(start, end, False)]
+
+    def _query_many(self, st, en, point, chunk_size=1 << 16):
+        '''Answer many queries level by level.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            the query and interval positions of the hits, sorted by query
+            and then by interval.
+        '''
+        qs, hits = [], []
+        # bound the size of the frontier arrays
+        for start in range(0, len(st), chunk_size):
+            q, i = self._query_chunk(st[start:start+chunk_size], en[start:start+chunk_size], point)
+            qs.append(q + start)
+            hits.append(i)
+        if not qs:
+            return np.array([], dtype=np.intp), np.array([], dtype=np.intp)
+        return np.concatenate(qs), np.concatenate(hits)
+
+    def _query_chunk(self, st, en, point):
+        n = len(self.starts)
+        starts, ends, mx = self.starts, self.ends, self._max
+        before = np.less_equal if point else np.less
+        k = self._root
+        q = np.arange(len(st)) if n else np.arange(0)
+        x = np.full(len(q), (1 << k) - 1)
+        # a node that hits rides along in the frontier in place of its
+        # subtree so that the frontier stays sorted by query and position
+        done = np.zeros(len(q), dtype=bool)
+        while k > 3 and len(q):
+            half = 1 << (k - 1)
+            real = x < n
+            xr = np.where(real, x, 0)
+            go_right = ~done & real & before(starts[xr], en[q])
+            hit = done | go_right & (st[q] < ends[xr])
+            y = x - half
+            go_left = ~done & ((y >= n) | (mx[np.minimum(y, n - 1)] > st[q]))
+            keep = np.stack([go_left, hit, go_right], axis=1).ravel()
+            q = np.repeat(q, 3)[keep]
+            x = np.stack([y, x, x + half], axis=1).ravel()[keep]
+            done = np.tile([False, True, False], len(done))[keep]
+            k -= 1
+        # scan the small subtrees left
+        width = (1 << (k + 1)) - 1
+        i = (x >> k << k)[:, None] + np.arange(width)
+        i[done] = x[done, None]
+        i = i.ravel()
+        q = np.repeat(q, width)
+        done = np.repeat(done, width)
+        keep = done & np.tile(np.arange(width) == 0, len(x))
+        real = i < n
+        i = np.where(real, i, 0)
+        keep |= ~done & real & before(starts[i], en[q]) & (st[q] < ends[i])
+        return q[keep], i[keep]
+
+    def stab_many(self, xs):
+        '''Find the intervals containing each of the points.
+
+        Parameters
+        ----------
+        xs : array_like
+            the points.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            the positions in ``xs`` and in the index of each hit.
+        '''
+        xs = np.asarray(xs)
+        return self._query_many(xs, xs, True)
+
+    def overlap_many(self, starts, ends):
+        '''Find the intervals overlapping each of the ranges [start, end).
+
+        Parameters
+        ----------
+        starts, ends : array_like
+            the ranges.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            the positions in the ranges and in the index of each hit.
+        '''
+        return self._query_many(np.asarray(starts), np.asarray(ends), False)
+
+    def count_many(self, starts, ends=None):
+        '''Count the intervals hitting each point, or each range if ends given.'''
+        if ends is None:
+            q, _ = self.stab_many(starts)
+        else:
+            q, _ = self.overlap_many(starts, ends)
+        return np.bincount(q, minlength=len(starts))
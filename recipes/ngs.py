@@ -1,88 +1,1111 @@
 import re
 import os
+import io
+import json
 import itertools
+import heapq
 import gzip
 import mmap
+import zlib
+import time
+import hashlib
+import sqlite3
+import threading
+from os.path import join
 from logging import getLogger
-from collections import defaultdict
+from array import array
+from bisect import bisect_left
+from collections import defaultdict, OrderedDict, Counter, deque
+from contextlib import ExitStack
+from tempfile import TemporaryDirectory
+from functools import partial, wraps
+from concurrent.futures import (
+    ThreadPoolExecutor, ProcessPoolExecutor, wait, as_completed, FIRST_COMPLETED)
 
+import numpy as np
 import pandas as pd
-from skbio.io import read
 
 
 def equal_seqs(seqs_1, seqs_2):
     '''Test two sequence collections are equal.
 
     The sequences are compared by their sequence char,
-    their IDs, and their descriptions. If both are equal,
+    their IDs, and their descriptions (and their quality
+    scores if any). If both are equal,
     they are considered as the same. Their order does
     not matter.
 
+    Each sequence is reduced to a fixed-size digest of these
+    fields, so the sequences are matched up in linear time. The
+    matches are then confirmed with full equality, which also
+    compares their types and all of their metadata.
+
     Parameters
     ----------
     seqs_1, seqs_2 : list of skbio.Sequence
+
+    Examples
+    --------
+    >>> from skbio import DNA
+    >>> equal_seqs([DNA('ATGC'), DNA('A')], [DNA('A'), DNA('ATGC')])
+    True
+    >>> equal_seqs([DNA('A'), DNA('A')], [DNA('A'), DNA('T')])
+    False
+    >>> from skbio import Sequence
+    >>> equal_seqs([DNA('A')], [Sequence('A')])
+    False
     '''
     if len(seqs_1) != len(seqs_2):
         return False
-
-    def sortable_key(seq):
-        l = [str(seq)]
-        md = seq.metadata
-        for k in ['id', 'description']:
-            if k in md:
-                l.append(md[k])
-            else:
-                l.append('')
-        return l
-
-    for i, j in zip(sorted(seqs_1, key=sortable_key),
-                    sorted(seqs_2, key=sortable_key)):
-        if i != j:
+    buckets = defaultdict(list)
+    for seq in seqs_1:
+        buckets[_seq_digest(seq)].append(seq)
+    for seq in seqs_2:
+        bucket = buckets.get(_seq_digest(seq))
+        if not bucket:
+            return False
+        for i, other in enumerate(bucket):
+            if other == seq:
+                del bucket[i]
+                break
+        else:
             return False
     return True
 
 
-def split_paired_end(fastq, prefix):
+def _seq_digest(seq):
+    '''Hash the sequence char, ID, description and quality of a sequence.'''
+    md = seq.metadata
+    qual = b''
+    if seq.has_positional_metadata() and 'quality' in seq.positional_metadata:
+        qual = seq.positional_metadata['quality'].values.astype(np.uint8).tobytes()
+    return _digest(seq.values.tobytes(), md.get('id', '').encode(),
+                   md.get('description', '').encode(), qual)
+
+
+def _digest(*fields):
+    h = hashlib.blake2b(digest_size=16)
+    for field in fields:
+        # prefix the length so the fields can't run into each other
+        h.update(len(field).to_bytes(8, 'little'))
+        h.update(field)
+    return h.digest()
+
+
+def equal_seq_files(file_1, file_2, format=None):
+    '''Test two FASTA or FASTQ files have the same sequences.
+
+    The records of both files are read side by side with
+    `read_records`, so the memory use is bounded whatever the file
+    size is. Each record is hashed as in `equal_seqs`, and the sums of
+    the digests are compared, so the order of the records does not
+    matter. The first position where the two files differ in order
+    is reported too.
+
+    Parameters
+    ----------
+    file_1, file_2 : str
+        the file paths, gzipped or not.
+    format : {'fasta', 'fastq', None}
+        the file format. It is detected from the first byte if it
+        is ``None``.
+
+    Returns
+    -------
+    tuple
+        whether they have the same sequences regardless of the
+        order, and the first differing position with the records
+        from both files, like ``(i, record_1, record_2)``, or
+        ``None`` if they are identical in order. The record is
+        ``None`` when that file ends first.
+    '''
+    # the sums of digests hash the multisets of the records
+    sums = [0, 0]
+    counts = [0, 0]
+    first = None
+    records = itertools.zip_longest(read_records(file_1, format),
+                                    read_records(file_2, format))
+    for i, recs in enumerate(records):
+        digests = []
+        for j, rec in enumerate(recs):
+            if rec is None:
+                digests.append(None)
+                continue
+            d = _digest(rec.seq, rec.id, rec.description, rec.qual or b'')
+            digests.append(d)
+            sums[j] += int.from_bytes(d, 'little')
+            counts[j] += 1
+        if first is None and digests[0] != digests[1]:
+            first = (i, *recs)
+    equal = counts[0] == counts[1] and sums[0] % (1 << 128) == sums[1] % (1 << 128)
+    return equal, first
+
+
+def split_paired_end(fastq, prefix, method='sort', buffer_size=100000,
+                     buckets=16, chunk_size=1000000, tmpdir=None,
+                     compresslevel=9, threads=1, bgzf=False, return_counts=False):
     '''Split reads of paired end into separate files.
 
     Parameters
     ----------
-    fastq : file object
-        file path to the input fastq.
+    fastq : str or file object
+        the input fastq. If it is a file path or a binary file object,
+        it is parsed with ``read_records`` and the reads are handled
+        as bytes without decoding.
+    prefix : str
+        path prefix of the output files.
+    method : {'sort', 'stream', 'external'}
+        how to pair up the mates. ``'sort'`` loads and sorts all the
+        reads in memory. ``'stream'`` reads the records one by one,
+        holds unmatched reads in a look-aside buffer of at most
+        ``buffer_size`` reads, and writes the outputs as it goes, so
+        the memory use doesn't grow with the input size.
+        ``'external'`` sorts the reads on disk (see
+        ``external_sort``). It suits the input whose mates are
+        scattered all over the file.
+    buffer_size : int
+        max number of unmatched reads held in memory in the
+        ``'stream'`` mode. The oldest ones are spilled to disk when
+        it is full.
+    buckets : int
+        number of files the spilled reads are hashed into by read
+        ID. Each of them is paired separately at the end, sorted
+        with ``external_sort`` in chunks of ``buffer_size`` reads.
+    chunk_size : int
+        number of reads sorted in memory at a time in the
+        ``'external'`` mode.
+    tmpdir : str or None
+        dir to hold the spilled reads or the sorted chunks. Use the
+        system default if it is ``None``.
+    compresslevel : int
+        gzip compression level of the outputs.
+    threads : int
+        number of threads to compress the outputs. If it is larger
+        than 1, the outputs are written with ``ParallelGzipWriter``
+        sharing a thread pool.
+    bgzf : bool
+        write the outputs in BGZF with the record indices, so they
+        can be read at random with `BgzfReader`.
+    return_counts : bool
+        also return the number of reads written to each file.
+
+    Returns
+    -------
+    list of str
+        the file paths of R1, R2, unpaired R1 and unpaired R2 reads.
+    list of int
+        the read numbers of the files, if ``return_counts`` is true.
+
+    Notes
+    -----
+    In the ``'stream'`` mode, a read ID that has more than two reads
+    is only detected if the extra reads arrive before the pair is
+    matched up.
+    '''
+    files = ['{}.{}.fq.gz'.format(prefix, i) for i in
+             ['r1', 'r2', 'r1_unpaired', 'r2_unpaired']]
+
+    binary = not isinstance(fastq, io.TextIOBase)
+    if binary:
+        seqs = (rec.lines() for rec in read_records(fastq, 'fastq'))
+    else:
+        seqs = _fastq_records(fastq)
+    if method == 'sort':
+        pairs = _pair_sorted(sorted(seqs))
+    elif method == 'stream':
+        pairs = _pair_streaming(seqs, buffer_size, buckets, tmpdir)
+    elif method == 'external':
+        pairs = _pair_sorted(external_sort(seqs, chunk_size, tmpdir=tmpdir))
+    else:
+        raise ValueError('Unknown method: {}'.format(method))
+
+    with ExitStack() as stack:
+        if bgzf:
+            executor = stack.enter_context(ThreadPoolExecutor(threads))
+            outs = [stack.enter_context(BgzfWriter(
+                f, compresslevel, executor=executor)) for f in files]
+        elif threads > 1:
+            executor = stack.enter_context(ThreadPoolExecutor(threads))
+            # close the writers before shutting down their pool
+            outs = [stack.enter_context(ParallelGzipWriter(
+                f, compresslevel, executor=executor)) for f in files]
+        else:
+            mode = 'wb' if binary else 'wt'
+            outs = [stack.enter_context(gzip.open(f, mode, compresslevel))
+                    for f in files]
+        counts = [0] * len(files)
+        for i, seq in pairs:
+            outs[i].write(_join(seq))
+            counts[i] += 1
+
+    if return_counts:
+        return files, counts
+    return files
+
+
+def split_paired_end_batch(inputs, out_dir, d=None, column=None, processes=None,
+                           max_memory=None, retries=1, **kwargs):
+    '''Split the interleaved fastq files of many samples in a process pool.
+
+    Parameters
+    ----------
+    inputs : pandas.DataFrame or list of str
+        a sample-by-file table, e.g. the output of
+        `create_sample_table`, or a list of the interleaved fastq
+        files, whose sample IDs are their names without the
+        ".fq"/".fastq" (and ".gz") suffix. The IDs must be unique;
+        use a table to name the files of the same name in different
+        dirs.
+    out_dir : str
+        the dir to write the outputs, named by the sample IDs.
+    d : str or None
+        the dir of the input files if their paths are relative.
+    column : str or None
+        the column of the table to split. Use the first column if it
+        is ``None``.
+    processes : int or None
+        number of worker processes. Use the number of CPUs if it
+        is ``None``.
+    max_memory : int or None
+        the max address space of each worker process in bytes.
+        A sample exceeding it fails with `MemoryError` and is retried.
+        Only supported on Unix.
+    retries : int
+        number of times to retry the failed samples, each time in a
+        new process pool.
+    kwargs : dict
+        other parameters passed to `split_paired_end`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        the sample-by-output table of read counts, counted while
+        writing the outputs. The samples failed after all the retries
+        are logged and left missing.
     '''
-    r1, r2, r1_unpaired, r2_unpaired = ([] for _ in range(4))
+    logger = getLogger(__name__)
+    if isinstance(inputs, pd.DataFrame):
+        if column is None:
+            column = inputs.columns[0]
+        samples = inputs[column].dropna().to_dict()
+    else:
+        samples = {}
+        for f in inputs:
+            sid = re.sub(r'\.(fq|fastq)(\.gz)?$', '', os.path.basename(f))
+            if sid in samples:
+                raise ValueError('Sample ID {} is shared by {} and {}.'.format(
+                    sid, samples[sid], f))
+            samples[sid] = f
+    if d is not None:
+        samples = {sid: join(d, f) for sid, f in samples.items()}
+
+    columns = ['r1', 'r2', 'r1_unpaired', 'r2_unpaired']
+    counts = pd.DataFrame(index=list(samples), columns=columns, dtype='Int64')
+    todo = list(samples)
+    for attempt in range(retries + 1):
+        if not todo:
+            break
+        failed = []
+        with ProcessPoolExecutor(processes, initializer=_limit_memory,
+                                 initargs=(max_memory,)) as executor:
+            futures = {executor.submit(
+                split_paired_end, samples[sid], join(out_dir, sid),
+                return_counts=True, **kwargs): sid for sid in todo}
+            for future in as_completed(futures):
+                sid = futures[future]
+                try:
+                    counts.loc[sid] = future.result()[1]
+                except Exception as e:
+                    # a crashed worker fails the other pending samples
+                    # too; they are all retried in a new pool
+                    logger.warning('Failed to split sample %s (attempt %d): %r',
+                                   sid, attempt + 1, e)
+                    failed.append(sid)
+        todo = failed
+    for sid in todo:
+        logger.error('Gave up splitting sample %s', sid)
+    return counts
+
 
-    lines = fastq.readlines()
-    # each seq has 4 lines in fastq file
-    seqs = [lines[i:i + 4] for i in range(0, len(lines), 4)]
-    seqs.sort()
+def _limit_memory(max_memory):
+    '''Limit the address space of the worker process.'''
+    if max_memory is not None:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
 
-    for seq_id, group in itertools.groupby(
-            seqs, key=lambda seq: seq[0].split(None, 1)[0]):
+
+def _fastq_records(fastq):
+    '''Yield each fastq record as a tuple of its 4 lines.'''
+    return zip(*[iter(fastq)] * 4)
+
+
+def _join(seq):
+    '''Join the lines of a record, either str or bytes.'''
+    return seq[0][:0].join(seq)
+
+
+def _read_id(seq):
+    return seq[0].split(None, 1)[0]
+
+
+def _pair_unpaired(seq):
+    '''Yield the output index of an unpaired read by its strand.'''
+    strand = seq[0].split()[1][:1]
+    if strand in ('1', b'1'):
+        yield 2, seq
+    elif strand in ('2', b'2'):
+        yield 3, seq
+
+
+def _pair_sorted(seqs):
+    '''Yield the output index and the read for the reads sorted by ID.'''
+    for seq_id, group in itertools.groupby(seqs, key=_read_id):
         reads = list(group)
-        # print('%r   -->  %r' % (seq_id, reads))
-        strands = [read[0].split()[1][0] for read in reads]
         if len(reads) == 2:
             # seqs is sorted, so the 1st must be R1 and 2nd must be R2
-            r1.append(reads[0])
-            r2.append(reads[1])
+            yield 0, reads[0]
+            yield 1, reads[1]
         elif len(reads) == 1:
-            if strands[0] == '1':
-                r1_unpaired.append(reads[0])
-            elif strands[0] == '2':
-                r2_unpaired.append(reads[0])
+            yield from _pair_unpaired(reads[0])
         else:
             raise ValueError(
                 'You have more than two reads in {}'.format(reads))
 
-    files = ['{}.{}.fq.gz'.format(prefix, i) for i in
-             ['r1', 'r2', 'r1_unpaired', 'r2_unpaired']]
-    for r, f in zip([r1, r2, r1_unpaired, r2_unpaired], files):
-        with gzip.open(f, 'wt') as fh:
-            for seq in r:
-                fh.write(''.join(seq))
 
-    return files
+def _pair_streaming(seqs, buffer_size, buckets, tmpdir):
+    '''Yield the output index and the read as the mates are matched.
+
+    The reads waiting for their mates are kept in the insertion
+    order, so the oldest ones are spilled first when the buffer
+    is full. No more than ``buffer_size`` reads are held in memory,
+    also when the spilled reads are paired at the end.
+    '''
+    pending = OrderedDict()
+    with ExitStack() as stack:
+        spills = None
+        for seq in seqs:
+            seq_id = _read_id(seq)
+            mate = pending.pop(seq_id, None)
+            if mate is None:
+                pending[seq_id] = seq
+                if len(pending) > buffer_size:
+                    if spills is None:
+                        mode = 'wb+' if isinstance(seq_id, bytes) else 'w+'
+                        d = stack.enter_context(TemporaryDirectory(dir=tmpdir))
+                        spills = [stack.enter_context(open(join(d, str(i)), mode))
+                                  for i in range(buckets)]
+                    _spill(spills, *pending.popitem(last=False))
+            else:
+                # the same order as `_pair_sorted`
+                r1, r2 = sorted([mate, seq])
+                yield 0, r1
+                yield 1, r2
+
+        if spills is None:
+            for seq in pending.values():
+                yield from _pair_unpaired(seq)
+        else:
+            # the mates of the spilled reads may still be in the buffer
+            for seq_id, seq in pending.items():
+                _spill(spills, seq_id, seq)
+            pending.clear()
+            for fh in spills:
+                fh.seek(0)
+                # a bucket can be larger than the buffer, so it is
+                # sorted on disk in chunks of the buffer size
+                yield from _pair_sorted(external_sort(
+                    _fastq_records(fh), buffer_size, tmpdir=tmpdir))
+
+
+def _spill(spills, seq_id, seq):
+    '''Write the read to the spill file its ID is hashed into.'''
+    if isinstance(seq_id, str):
+        seq_id = seq_id.encode()
+    i = zlib.crc32(seq_id) % len(spills)
+    spills[i].write(_join(seq))
+
+
+def external_sort(seqs, chunk_size=1000000, fan_in=64, tmpdir=None):
+    r'''Sort the fastq records with bounded memory.
+
+    The records are sorted in chunks of ``chunk_size`` in memory
+    and each sorted chunk is spilled into a temporary gzipped file.
+    The chunks are then merged k-way with a heap. If there are more
+    than ``fan_in`` chunks, they are merged in several passes to
+    limit the number of files open at the same time.
+
+    Parameters
+    ----------
+    seqs : Iterable of tuple of str or bytes
+        fastq records, each as a tuple of its 4 lines.
+    chunk_size : int
+        number of records sorted in memory at a time.
+    fan_in : int
+        max number of chunk files merged at a time.
+    tmpdir : str or None
+        dir to hold the chunk files. Use the system default if
+        it is ``None``.
+
+    Yields
+    ------
+    tuple of str or bytes
+        the sorted records.
+
+    Examples
+    --------
+    >>> seqs = [('@b 1\n', 'A\n', '+\n', 'F\n'),
+    ...         ('@a 2\n', 'T\n', '+\n', 'F\n'),
+    ...         ('@a 1\n', 'G\n', '+\n', 'F\n')]
+    >>> [seq[0] for seq in external_sort(seqs, chunk_size=1)]
+    ['@a 1\n', '@a 2\n', '@b 1\n']
+    '''
+    if fan_in < 2:
+        raise ValueError('fan_in must be at least 2.')
+    with TemporaryDirectory(dir=tmpdir) as d:
+        chunks = []
+        seqs = iter(seqs)
+        mode = 't'
+        while True:
+            chunk = sorted(itertools.islice(seqs, chunk_size))
+            if not chunk:
+                break
+            if isinstance(chunk[0][0], bytes):
+                mode = 'b'
+            chunks.append(_write_chunk(chunk, join(d, str(len(chunks))), mode))
+        # merge in passes until the rest can be opened at once
+        n = len(chunks)
+        while len(chunks) > fan_in:
+            merged = []
+            for i in range(0, len(chunks), fan_in):
+                group = chunks[i:i + fan_in]
+                with ExitStack() as stack:
+                    fhs = [stack.enter_context(gzip.open(f, 'r' + mode)) for f in group]
+                    merged.append(_write_chunk(
+                        heapq.merge(*map(_fastq_records, fhs)), join(d, str(n)), mode))
+                n += 1
+                for f in group:
+                    os.remove(f)
+            chunks = merged
+        with ExitStack() as stack:
+            fhs = [stack.enter_context(gzip.open(f, 'r' + mode)) for f in chunks]
+            yield from heapq.merge(*map(_fastq_records, fhs))
+
+
+def _write_chunk(seqs, f, mode):
+    '''Write the records into a temporary gzipped file fast.'''
+    with gzip.open(f, 'w' + mode, compresslevel=1) as fh:
+        for seq in seqs:
+            fh.write(_join(seq))
+    return f
+
+
+class RecordView:
+    '''A FASTA or FASTQ record located in a bytes buffer.
+
+    It only keeps the offsets of the record in the buffer, and the
+    fields are sliced out of the buffer only when they are accessed.
+    The header line starts at ``start``; the sequence spans from
+    ``seq_start`` to ``seq_end``; the quality (FASTQ only) starts at
+    ``qual_start``; and the record ends at ``end``. ``qual_start``
+    is ``None`` for FASTA records.
+    '''
+    __slots__ = ('buf', 'start', 'seq_start', 'seq_end', 'qual_start', 'end')
+
+    def __init__(self, buf, start, seq_start, seq_end, qual_start, end):
+        self.buf = buf
+        self.start = start
+        self.seq_start = seq_start
+        self.seq_end = seq_end
+        self.qual_start = qual_start
+        self.end = end
+
+    def __repr__(self):
+        return '%s(%r, start=%d, end=%d)' % (
+            self.__class__.__name__, self.header, self.start, self.end)
+
+    def __len__(self):
+        '''Return the sequence length.'''
+        n = self.seq_end - self.seq_start
+        if self.qual_start is None:
+            # FASTA sequence can wrap over lines
+            n -= self.buf[self.seq_start:self.seq_end].count(b'\n')
+        return n
+
+    @property
+    def header(self):
+        '''The header line without the leading ">" or "@".'''
+        return self.buf[self.start + 1:self.seq_start - 1]
+
+    @property
+    def id(self):
+        return self.header.split(None, 1)[0]
+
+    @property
+    def description(self):
+        fields = self.header.split(None, 1)
+        return fields[1] if len(fields) == 2 else b''
+
+    @property
+    def seq(self):
+        seq = self.buf[self.seq_start:self.seq_end]
+        if self.qual_start is None:
+            seq = seq.replace(b'\n', b'')
+        return seq
+
+    @property
+    def qual(self):
+        if self.qual_start is None:
+            return None
+        return self.buf[self.qual_start:self.end].rstrip(b'\n')
+
+    @property
+    def raw(self):
+        '''The whole record as a ``memoryview`` of the buffer.'''
+        return memoryview(self.buf)[self.start:self.end]
+
+    def lines(self):
+        '''Return the 4 lines of a FASTQ record as a tuple of bytes.'''
+        buf = self.buf
+        qual = buf[self.qual_start:self.end]
+        if not qual.endswith(b'\n'):
+            qual += b'\n'
+        return (buf[self.start:self.seq_start],
+                buf[self.seq_start:self.seq_end + 1],
+                buf[self.seq_end + 1:self.qual_start],
+                qual)
+
+
+def iter_fastq(buf, pos=0, final=True):
+    r'''Yield the records of FASTQ in a bytes buffer as ``RecordView``.
+
+    Each record must have 4 lines. The lines are located with
+    ``buf.find``, so no string is created for them.
+
+    Parameters
+    ----------
+    buf : bytes, bytearray or mmap.mmap
+        the buffer holding FASTQ records.
+    pos : int
+        the position in the buffer to start with.
+    final : bool
+        whether the buffer ends with the end of the file. If not,
+        the last incomplete record is not yielded.
+
+    Examples
+    --------
+    >>> buf = b'@r1 1:N\nATGC\n+\nFFFF\n@r2\nAT\n+\nFF'
+    >>> for rec in iter_fastq(buf):
+    ...     print(rec.id, rec.seq, rec.qual, len(rec))
+    b'r1' b'ATGC' b'FFFF' 4
+    b'r2' b'AT' b'FF' 2
+    >>> [rec.id for rec in iter_fastq(buf, final=False)]
+    [b'r1']
+    '''
+    n = len(buf)
+    find = buf.find
+    while pos < n:
+        if buf[pos:pos + 1] == b'\n':
+            # skip blank lines
+            pos += 1
+            continue
+        if buf[pos:pos + 1] != b'@':
+            raise ValueError('FASTQ record does not start with "@" at %d' % pos)
+        i = find(b'\n', pos)
+        j = find(b'\n', i + 1) if i >= 0 else -1
+        k = find(b'\n', j + 1) if j >= 0 else -1
+        end = find(b'\n', k + 1) + 1 if k >= 0 else 0
+        if end == 0:
+            if not final:
+                return
+            if k < 0:
+                raise ValueError('Truncated FASTQ record at %d' % pos)
+            # the last line has no newline
+            end = n
+        yield RecordView(buf, pos, i + 1, j, k + 1, end)
+        pos = end
+
+
+def iter_fasta(buf, pos=0, final=True):
+    r'''Yield the records of FASTA in a bytes buffer as ``RecordView``.
+
+    The sequence of a record can wrap over several lines.
+
+    Parameters
+    ----------
+    buf : bytes, bytearray or mmap.mmap
+        the buffer holding FASTA records.
+    pos : int
+        the position in the buffer to start with.
+    final : bool
+        whether the buffer ends with the end of the file. If not,
+        the last record is not yielded because it may be incomplete.
+
+    Examples
+    --------
+    >>> buf = b'>s1 a b\nAT\nGC\n>s2\nA\n'
+    >>> for rec in iter_fasta(buf):
+    ...     print(rec.id, rec.description, rec.seq, len(rec))
+    b's1' b'a b' b'ATGC' 4
+    b's2' b'' b'A' 1
+    '''
+    n = len(buf)
+    find = buf.find
+    while pos < n:
+        if buf[pos:pos + 1] == b'\n':
+            # skip blank lines
+            pos += 1
+            continue
+        if buf[pos:pos + 1] != b'>':
+            raise ValueError('FASTA record does not start with ">" at %d' % pos)
+        i = find(b'\n', pos)
+        if i < 0:
+            if not final:
+                return
+            # a header line without newline at the end of the file
+            i = n
+        j = find(b'\n>', i)
+        if j < 0:
+            if not final:
+                return
+            end = n
+            j = n - 1 if buf[n - 1:n] == b'\n' else n
+        else:
+            end = j + 1
+        yield RecordView(buf, pos, i + 1, max(j, i + 1), None, end)
+        pos = end
+
+
+def read_records(fp, format=None, block_size=1 << 24):
+    '''Yield the records in a FASTA or FASTQ file as ``RecordView``.
+
+    A plain file is memory mapped and scanned as a whole, so the
+    records are views into the mapping. A gzipped file or a file
+    object is read in blocks of ``block_size`` bytes.
+
+    Parameters
+    ----------
+    fp : str or binary file object
+        the input file. It is decompressed if its name ends with ".gz".
+    format : {'fasta', 'fastq', None}
+        the file format. It is detected from the first byte if it
+        is ``None``.
+    block_size : int
+        number of bytes read at a time.
+    '''
+    with ExitStack() as stack:
+        if isinstance(fp, (str, os.PathLike)):
+            if str(fp).endswith('.gz'):
+                fh = stack.enter_context(gzip.open(fp))
+            else:
+                fh = stack.enter_context(open(fp, 'rb'))
+                if os.fstat(fh.fileno()).st_size == 0:
+                    return
+                # the views keep the mapping open as long as they live
+                buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+                yield from _scanner(buf, format)(buf)
+                return
+        else:
+            fh = fp
+
+        scan = None
+        # the blocks of the incomplete record left over and its newlines
+        pending = []
+        newlines = 0
+        while True:
+            block = fh.read(block_size)
+            if not block:
+                break
+            if scan is None:
+                scan = _scanner(block, format)
+            if pending:
+                # only the new block is searched for the end of the
+                # record; it is not scanned again until it is complete
+                if scan is iter_fastq:
+                    newlines += block.count(b'\n')
+                    complete = newlines >= 4
+                else:
+                    complete = (b'\n>' in block or
+                                pending[-1].endswith(b'\n') and block.startswith(b'>'))
+                if not complete:
+                    pending.append(block)
+                    continue
+            pending.append(block)
+            buf = b''.join(pending)
+            pos = 0
+            for rec in scan(buf, final=False):
+                yield rec
+                pos = rec.end
+            # carry the incomplete record over to the next block
+            tail = buf[pos:].lstrip(b'\n')
+            pending = [tail] if tail else []
+            newlines = tail.count(b'\n')
+        if pending:
+            yield from scan(b''.join(pending))
+
+
+def _detect_format(buf, format=None):
+    '''Detect FASTA or FASTQ from the first byte if format is not given.'''
+    if format is None:
+        format = 'fastq' if buf[:1] == b'@' else 'fasta'
+    if format not in ('fasta', 'fastq'):
+        raise ValueError('Unknown format: {}'.format(format))
+    return format
+
+
+def _scanner(buf, format):
+    if _detect_format(buf, format) == 'fastq':
+        return iter_fastq
+    return iter_fasta
+
+
+class ParallelGzipWriter:
+    r'''Write a gzip file by compressing blocks of it in parallel.
+
+    The data written is cut into blocks of ``block_size`` bytes. Each
+    block is compressed into an independent gzip member in a thread
+    pool (``zlib`` releases the GIL while compressing) and the
+    members are written in order, so the output is a valid
+    multi-member gzip file just like what ``pigz`` produces. Each
+    member also records its size in a "PZ" subfield of its header, as
+    BGZF does in "BC", so `count_gzip_lines` can locate the members
+    without decompression and count them in parallel.
+
+    Parameters
+    ----------
+    filename : str
+        the output file path.
+    compresslevel : int
+        gzip compression level.
+    block_size : int
+        number of uncompressed bytes in each gzip member.
+    executor : concurrent.futures.Executor or None
+        the pool to compress the blocks. It can be shared among
+        several writers. If it is ``None``, a thread pool of
+        ``threads`` workers is created and shut down on closing.
+    threads : int or None
+        number of threads of the pool created by the writer.
+    max_pending : int
+        max number of blocks being compressed at the same time. It
+        bounds the memory use.
+
+    Examples
+    --------
+    >>> import gzip
+    >>> from tempfile import TemporaryDirectory
+    >>> from os.path import join
+    >>> with TemporaryDirectory() as d:
+    ...     f = join(d, 'a.gz')
+    ...     with ParallelGzipWriter(f, block_size=4, threads=2) as fh:
+    ...         _ = fh.write('ATGC\nATGC\n')
+    ...     with gzip.open(f, 'rt') as fh:
+    ...         print(fh.read(), end='')
+    ATGC
+    ATGC
+    '''
+    def __init__(self, filename, compresslevel=9, block_size=1 << 20,
+                 executor=None, threads=None, max_pending=16):
+        self.compresslevel = compresslevel
+        self.block_size = block_size
+        self.max_pending = max_pending
+        self._own_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(threads)
+        self._executor = executor
+        self._fh = open(filename, 'wb')
+        self._buf = []
+        self._size = 0
+        self._pending = deque()
+        self._empty = True
+
+    @property
+    def closed(self):
+        return self._fh.closed
+
+    def write(self, data):
+        '''Write a str or bytes. Return the length of the input.'''
+        n = len(data)
+        if isinstance(data, str):
+            data = data.encode()
+        self._buf.append(data)
+        self._size += len(data)
+        if self._size >= self.block_size:
+            self._submit()
+        return n
+
+    def _compress(self, data):
+        c = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+        cdata = c.compress(data) + c.flush()
+        # the extra field "PZ" records the member size
+        size = len(cdata) + 28
+        if size >= 1 << 32:
+            return gzip.compress(data, self.compresslevel, mtime=0)
+        header = (b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x08\x00PZ\x04\x00' +
+                  size.to_bytes(4, 'little'))
+        trailer = (zlib.crc32(data).to_bytes(4, 'little') +
+                   (len(data) & 0xffffffff).to_bytes(4, 'little'))
+        return header + cdata + trailer
+
+    def _submit(self):
+        data = b''.join(self._buf)
+        self._buf = []
+        self._size = 0
+        self._empty = False
+        self._pending.append(self._executor.submit(self._compress, data))
+        while len(self._pending) > self.max_pending:
+            self._write_member(self._pending.popleft().result())
+
+    def _write_member(self, member):
+        self._fh.write(member)
+
+    def _finish(self):
+        '''Write anything needed after the last member.'''
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            # always write one member so an empty file is valid gzip
+            if self._buf or self._empty:
+                self._submit()
+            while self._pending:
+                self._write_member(self._pending.popleft().result())
+            self._finish()
+        finally:
+            self._fh.close()
+            if self._own_executor:
+                self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class BgzfWriter(ParallelGzipWriter):
+    r'''Write a BGZF file with an index of the record offsets.
+
+    BGZF (as written by ``bgzip`` and used by BAM) is a multi-member
+    gzip file of blocks of at most 64 KB, each recording its size in
+    the header, so it can be read by any gzip reader and also be
+    seeked into. A position in it is a virtual offset: the file
+    offset of the block shifted left by 16 bits plus the offset
+    inside the decompressed block.
+
+    Each call of `write` is taken as a record, and the virtual
+    offsets of the records are written into a sidecar index file
+    (see `bgzf_index_path`) as their blocks are written, for
+    `BgzfReader` to fetch any record without decompressing from the
+    start. The blocks are compressed in parallel as in
+    `ParallelGzipWriter`.
+
+    Parameters
+    ----------
+    filename : str
+        the output file path.
+    compresslevel : int
+        gzip compression level.
+    index : bool
+        whether to write the index.
+    executor, threads, max_pending
+        see `ParallelGzipWriter`.
+
+    Examples
+    --------
+    >>> from tempfile import TemporaryDirectory
+    >>> from os.path import join
+    >>> with TemporaryDirectory() as d:
+    ...     f = join(d, 'a.fq.gz')
+    ...     with BgzfWriter(f, threads=2) as fh:
+    ...         for i in range(10000):
+    ...             _ = fh.write('@r%d\nATGC\n+\nFFFF\n' % i)
+    ...     with BgzfReader(f) as fh:
+    ...         print(len(fh), fh[9999], fh[5000:5002])
+    10000 b'@r9999\nATGC\n+\nFFFF\n' [b'@r5000\nATGC\n+\nFFFF\n', b'@r5001\nATGC\n+\nFFFF\n']
+    '''
+    # the max data size of a block, the same as bgzip
+    BLOCK_SIZE = 0xff00
+    # the empty block marking the end of file
+    EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+    def __init__(self, filename, compresslevel=9, index=True,
+                 executor=None, threads=None, max_pending=16):
+        super().__init__(filename, compresslevel, self.BLOCK_SIZE,
+                         executor, threads, max_pending)
+        self.filename = filename
+        # the EOF block makes an empty file valid
+        self._empty = False
+        self._index = index
+        self._index_fh = open(bgzf_index_path(filename), 'wb') if index else None
+        # the block number shifted left by 16 bits plus the offset in
+        # it of each record whose block is not written yet
+        self._starts = array('Q')
+        self._blocks = 0
+        # the number of the blocks written and the file offset after them
+        self._written = 0
+        self._offset = 0
+
+    def write(self, data):
+        n = len(data)
+        if isinstance(data, str):
+            data = data.encode()
+        if self._index:
+            self._starts.append(self._blocks << 16 | self._size)
+        # cut the data at the block size
+        while data:
+            i = self.block_size - self._size
+            self._buf.append(data[:i])
+            self._size += len(data[:i])
+            data = data[i:]
+            if self._size == self.block_size:
+                self._submit()
+        return n
+
+    def _submit(self):
+        self._blocks += 1
+        super()._submit()
+
+    def _compress(self, data):
+        c = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+        cdata = c.compress(data) + c.flush()
+        # the extra field "BC" records the block size minus 1
+        bsize = len(cdata) + 25
+        header = (b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00' +
+                  bsize.to_bytes(2, 'little'))
+        trailer = (zlib.crc32(data).to_bytes(4, 'little') +
+                   len(data).to_bytes(4, 'little'))
+        return header + cdata + trailer
+
+    def _write_member(self, member):
+        super()._write_member(member)
+        self._written += 1
+        # the records starting in the block
+        self._write_index(bisect_left(self._starts, self._written << 16))
+        self._offset += len(member)
+
+    def _write_index(self, n):
+        '''Write the virtual offsets of the first n pending records.'''
+        if not (self._index and n):
+            return
+        within = np.frombuffer(self._starts[:n], dtype=np.uint64) & np.uint64(0xffff)
+        voffsets = np.uint64(self._offset << 16) | within
+        self._index_fh.write(voffsets.astype('<u8').tobytes())
+        del self._starts[:n]
+
+    def _finish(self):
+        # the records written after the last block start at the EOF block
+        self._write_index(len(self._starts))
+        self._fh.write(self.EOF)
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            if self._index_fh is not None:
+                self._index_fh.close()
+
+
+def bgzf_index_path(filename):
+    '''Return the path of the record index of a BGZF file.'''
+    return filename + '.vidx'
+
+
+class BgzfReader:
+    '''Fetch the records of a BGZF file written by `BgzfWriter`.
+
+    The records are located by their virtual offsets in the index,
+    so only the blocks holding them are decompressed. Indexing it
+    with an int returns the record as bytes, and with a slice a
+    list of records.
+
+    Parameters
+    ----------
+    filename : str
+        the BGZF file.
+    index : str or None
+        the index file. Use `bgzf_index_path` if it is ``None``.
+    '''
+    def __init__(self, filename, index=None):
+        if index is None:
+            index = bgzf_index_path(filename)
+        self.voffsets = np.fromfile(index, dtype='<u8')
+        self._fh = open(filename, 'rb')
+
+    def __len__(self):
+        return len(self.voffsets)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            positions = range(*i.indices(len(self)))
+            if not positions:
+                return []
+            # read the records covering the slice in either direction
+            lo, hi = min(positions), max(positions) + 1
+            data, starts = self._read(lo, hi)
+            starts.append(len(data))
+            return [data[starts[j - lo]:starts[j - lo + 1]] for j in positions]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('record index out of range')
+        return self._read(i, i + 1)[0]
+
+    def _split(self, i):
+        '''Split the virtual offset of record i.'''
+        v = int(self.voffsets[i])
+        return v >> 16, v & 0xffff
+
+    def _read(self, start, stop):
+        '''Read the records from start to before stop.
+
+        Returns
+        -------
+        bytes
+            the data of the records.
+        list of int
+            the offsets of the records in the data.
+        '''
+        b0, w0 = self._split(start)
+        if stop < len(self):
+            b1, w1 = self._split(stop)
+        else:
+            b1, w1 = os.fstat(self._fh.fileno()).st_size, 0
+        # the decompressed offset of each block
+        pos = {}
+        chunks = []
+        total = 0
+        b = b0
+        while b < b1 or (b == b1 and w1):
+            data, bsize = self._block(b)
+            pos[b] = total
+            chunks.append(data)
+            total += len(data)
+            b += bsize
+        # the empty records at the start of block b1
+        pos[b] = total
+        data = b''.join(chunks)
+        end = pos[b1] + w1 if w1 else total
+        starts = [pos[b] + w - w0 for b, w in map(self._split, range(start, stop))]
+        return data[w0:end], starts
+
+    def _block(self, offset):
+        '''Return the decompressed data and the size of a block.'''
+        self._fh.seek(offset)
+        header = self._fh.read(18)
+        bsize = _bgzf_block_size(header[12:18])
+        if header[:4] != b'\x1f\x8b\x08\x04' or bsize is None:
+            raise ValueError('Not a BGZF block at offset %d' % offset)
+        cdata = self._fh.read(bsize - 26)
+        return zlib.decompress(cdata, -zlib.MAX_WBITS), bsize
+
+    def close(self):
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
 
 def compute_n50(nums, cutoff=500):
@@ -109,29 +1132,90 @@ def compute_n50(nums, cutoff=500):
     >>> compute_n50(i for i in nums)
     545
     '''
-    nums = [i for i in nums if i >= cutoff]
-    n50_len = sum(nums) / 2
-    length = 0
-    for i in sorted(nums, reverse=True):
-        length += i
-        if length >= n50_len:
-            return i
-    # if nums is empty
-    return 0
+    return assembly_stats(nums, cutoff, levels=(50,))['N50']
+
+
+def assembly_stats(nums, cutoff=500, levels=(50, 90)):
+    '''Compute Nx, Lx, total length and count of the contig lengths.
+
+    The lengths are counted into a histogram in one pass, so the
+    memory use is proportional to the number of distinct lengths
+    rather than the number of contigs. A NumPy array of lengths is
+    processed with vectorized operations.
+
+    Parameters
+    ----------
+    nums : Iterable, int
+        contig lengths
+    cutoff : int
+        only consider the contigs >= cutoff.
+    levels : Iterable, int
+        the x in Nx and Lx to compute.
+
+    Returns
+    -------
+    dict
+        Nx is the length of the shortest contig among the longest
+        contigs that cover x% of the total length; Lx is the number
+        of those longest contigs.
+
+    Examples
+    --------
+    >>> stats = assembly_stats([2, 2, 3, 4, 5, 9], cutoff=0)
+    >>> [stats[i] for i in ['count', 'total', 'N50', 'L50', 'N90', 'L90']]
+    [6, 25, 5, 2, 2, 5]
+    >>> assembly_stats([])
+    {'count': 0, 'total': 0, 'N50': 0, 'L50': 0, 'N90': 0, 'L90': 0}
+    '''
+    if isinstance(nums, np.ndarray):
+        nums = nums[nums >= cutoff]
+        lengths, counts = np.unique(nums, return_counts=True)
+    else:
+        hist = Counter(i for i in nums if i >= cutoff)
+        lengths = np.fromiter(hist.keys(), dtype=np.int64, count=len(hist))
+        counts = np.fromiter(hist.values(), dtype=np.int64, count=len(hist))
+        order = np.argsort(lengths)
+        lengths, counts = lengths[order], counts[order]
+    return _histogram_stats(lengths, counts, levels)
+
+
+def _histogram_stats(lengths, counts, levels):
+    '''Compute the assembly stats from the histogram sorted by length.'''
+    # from the longest to the shortest
+    lengths = np.asarray(lengths, dtype=np.int64)[::-1]
+    counts = np.asarray(counts, dtype=np.int64)[::-1]
+    cum_len = np.cumsum(lengths * counts)
+    cum_count = np.cumsum(counts)
+    total = int(cum_len[-1]) if len(cum_len) else 0
+    stats = {'count': int(cum_count[-1]) if len(cum_count) else 0,
+             'total': total}
+    for x in levels:
+        if total == 0:
+            stats['N%d' % x] = stats['L%d' % x] = 0
+            continue
+        target = total * x / 100
+        i = int(np.searchsorted(cum_len, target))
+        covered = cum_len[i - 1] if i else 0
+        # the contigs needed from the group of the Nx length
+        needed = -(-(target - covered) // lengths[i])
+        stats['N%d' % x] = int(lengths[i])
+        stats['L%d' % x] = int((cum_count[i - 1] if i else 0) + max(needed, 1))
+    return stats
 
 
 def create_sample_table(d,
                         file_types, pattern_types,
                         get_id=lambda x: re.split('_L00[0-9]_R[12]_', x)[0],
                         select=lambda x: x.endswith('.fq.gz'),
-                        negate=False):
+                        negate=False, recursive=False, threads=1, manifest=None):
     '''Return a sample-by-file-path table of the raw sequence files.
 
     Notes
     -----
     The returned data frame can serve as the input for operations done on
     each file. For example, you can calculate the reads number of each
-    file using `pd.DataFrame.applymap`.
+    file using `pd.DataFrame.applymap`, or concurrently using
+    `count_sample_table`.
 
     Parameters
     ----------
@@ -145,6 +1229,16 @@ def create_sample_table(d,
         what files to include
     negate : boolean
         negate the select.
+    recursive : boolean
+        also include the files in the sub-dirs. The file paths in
+        the table are relative to ``d``, while ``get_id``, ``select``
+        and the patterns apply to the file names.
+    threads : int
+        number of threads to scan the sub-dirs concurrently. It
+        helps on network storage.
+    manifest : str or None
+        a JSON file to cache the dir listings. A dir is listed again
+        only if its mtime has changed since it was cached.
 
     Returns
     -------
@@ -157,19 +1251,24 @@ def create_sample_table(d,
 
     logger = getLogger(__name__)
 
+    # check the file name only matches one unique pattern
+    sorting = PatternMatcher(pattern_types)
+
     samples = defaultdict(list)
 
-    for f in os.listdir(d):
+    for f in scan_dir(d, recursive, threads, manifest):
+        name = os.path.basename(f)
         if negate:
-            flag = not select(f)
+            flag = not select(name)
         else:
-            flag = select(f)
+            flag = select(name)
         if flag:
             try:
-                sid = get_id(f)
+                sid = get_id(name)
             except:
                 raise ValueError('Can not extract sample ID from file name: %s' % f)
-            samples[sid].append(f)
+            # match the patterns once per file
+            samples[sid].append((sorting(name), f))
 
     for sid, files in samples.items():
         if len(files) != len(file_types):
@@ -177,10 +1276,9 @@ def create_sample_table(d,
                 'For sample {}, you have unmatching file names:\n'
                 '{}\n'
                 'and file types:\n'
-                '{}'.format(sid, files, file_types))
-        # check the file name only matches one unique pattern
-        sorting = sort_by_pattern(pattern_types)
-        files.sort(key=sorting)
+                '{}'.format(sid, [f for _, f in files], file_types))
+        files.sort()
+        samples[sid] = [f for _, f in files]
 
     df = pd.DataFrame.from_dict(samples, orient='index')
     df.columns = file_types
@@ -188,6 +1286,76 @@ def create_sample_table(d,
     return df
 
 
+def scan_dir(d, recursive=False, threads=1, manifest=None):
+    '''Return the paths of the files in the dir, relative to it.
+
+    The dir is listed with `os.scandir`, which gets the file types
+    without a `stat` call per file on most file systems. The sub-dirs
+    of the same depth are listed concurrently. As in `os.walk`, the
+    symlinks to dirs are not followed.
+
+    Parameters
+    ----------
+    d : str
+        the dir to scan.
+    recursive : bool
+        also scan the sub-dirs.
+    threads : int
+        number of threads to list the sub-dirs.
+    manifest : str or None
+        a JSON file to cache the listing of each dir with its mtime.
+        The cached listing is used if the dir mtime is unchanged.
+
+    Returns
+    -------
+    list of str
+    '''
+    cache = {}
+    if manifest is not None:
+        try:
+            with open(manifest) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    files = []
+    subdirs = ['']
+    with ThreadPoolExecutor(threads) as executor:
+        while subdirs:
+            listings = list(executor.map(partial(_list_dir, d, cache), subdirs))
+            subdirs = []
+            for rel, (mtime, fs, ds) in listings:
+                cache[rel] = {'mtime_ns': mtime, 'files': fs, 'dirs': ds}
+                files.extend(join(rel, i) for i in fs)
+                if recursive:
+                    subdirs.extend(join(rel, i) for i in ds)
+
+    if manifest is not None:
+        with open(manifest, 'w') as f:
+            json.dump(cache, f)
+    return files
+
+
+def _list_dir(d, cache, rel):
+    '''List the file and dir names in the dir, or reuse the cached ones.'''
+    path = join(d, rel)
+    mtime = os.stat(path).st_mtime_ns
+    cached = cache.get(rel)
+    if cached is not None and cached['mtime_ns'] == mtime:
+        return rel, (mtime, cached['files'], cached['dirs'])
+    fs = []
+    ds = []
+    with os.scandir(path) as it:
+        for entry in it:
+            # like os.walk, the symlinks to dirs are not followed, so
+            # they can't loop or list the files twice
+            if entry.is_dir(follow_symlinks=False):
+                ds.append(entry.name)
+            elif not entry.is_dir():
+                fs.append(entry.name)
+    return rel, (mtime, fs, ds)
+
+
 def sort_by_pattern(patterns):
     '''Sort the list by the order of matching patterns.
 
@@ -208,28 +1376,286 @@ def sort_by_pattern(patterns):
     >>> c.sort(key=match)
     >>> c
     ['a_R1_paired.fq', 'b_R1_paired.fq', 'a_R2_unpaired.fq']
+    >>> match('a_R3_paired.fq')
+    Traceback (most recent call last):
+    ...
+    ValueError: 'a_R3_paired.fq' does not match any of the patterns: ['R1_paired', 'R2_paired', 'R1_unpaired', 'R2_unpaired']
+    '''
+    return PatternMatcher(patterns)
+
+
+class PatternMatcher:
+    '''Find the only pattern that a string matches.
+
+    All the patterns are combined into a single regex of optional
+    lookaheads, one named group per pattern, so a string is matched
+    against all of them in one pass, and the result of each string
+    is memoized. An instance is a key function for sorting strings
+    by the order of their matching patterns.
+
+    Parameters
+    ----------
+    patterns : list of str or re.Pattern
+        the patterns searched anywhere in a string, like `re.search`.
+
+    Examples
+    --------
+    >>> match = PatternMatcher(['_R1', '_R2', '_R[12]'])
+    >>> match.matches('a_R2.fq')
+    [1, 2]
+    >>> match('a_R2.fq')
+    Traceback (most recent call last):
+    ...
+    ValueError: 'a_R2.fq' matches more than one pattern: ['_R2', '_R[12]']
+    '''
+    def __init__(self, patterns):
+        self._compiled = [re.compile(p) for p in patterns]
+        self.patterns = [p.pattern for p in self._compiled]
+        if all(p.groups == 0 and p.flags == re.UNICODE for p in self._compiled):
+            self._regex = re.compile(''.join(
+                '(?:(?=.*?(?P<_%d>%s)))?' % (i, p)
+                for i, p in enumerate(self.patterns)), re.DOTALL)
+        else:
+            # the patterns with groups (which could be referred to by
+            # number) or flags are searched one by one
+            self._regex = None
+        self._cache = {}
+
+    def matches(self, s):
+        '''Return the indices of all the patterns that the string matches.'''
+        try:
+            return self._cache[s]
+        except KeyError:
+            pass
+        if self._regex is None:
+            found = [i for i, p in enumerate(self._compiled) if p.search(s)]
+        else:
+            groups = self._regex.match(s).groupdict()
+            found = [i for i in range(len(self.patterns))
+                     if groups['_%d' % i] is not None]
+        self._cache[s] = found
+        return found
+
+    def __call__(self, s):
+        found = self.matches(s)
+        if len(found) == 1:
+            return found[0]
+        if found:
+            raise ValueError('%r matches more than one pattern: %r' % (
+                s, [self.patterns[i] for i in found]))
+        raise ValueError('%r does not match any of the patterns: %r' % (
+            s, self.patterns))
+
+
+class MetricCache:
+    '''On-disk cache of the metrics computed from files.
+
+    The metrics are stored in a SQLite database, keyed by the
+    function name, the arguments that affect the value, and the
+    absolute path, size and mtime of the file. Optionally a fast
+    hash of the head and tail of the file content is added to the
+    key too. The least recently used entries are evicted when there
+    are more than ``max_entries``.
+
+    Parameters
+    ----------
+    path : str or None
+        the database file. If it is ``None``, it is read from the
+        environment variable ``RECIPES_CACHE`` or defaults to
+        "~/.cache/recipes/metrics.sqlite".
+    max_entries : int
+        max number of entries to keep.
+    content_hash : bool
+        whether to add a hash of the file content to the key.
+    enabled : bool
+        whether to use the cache. It can be turned off any time.
+
+    Attributes
+    ----------
+    hits, misses : int
+        number of the cache hits and misses in this process.
+
+    Examples
+    --------
+    >>> from tempfile import TemporaryDirectory
+    >>> from os.path import join
+    >>> with TemporaryDirectory() as d:
+    ...     cache = MetricCache(join(d, 'cache.sqlite'))
+    ...     @cache.cached()
+    ...     def size(filename):
+    ...         return os.path.getsize(filename)
+    ...     f = join(d, 'a.txt')
+    ...     _ = open(f, 'w').write('abc')
+    ...     _ = size(f), size(f), size(f, cache=False)
+    ...     print(cache.stats())
+    {'hits': 1, 'misses': 1, 'entries': 1}
     '''
-    def _sort_key(s):
-        l = [i for i, p in enumerate(patterns) if re.search(p, s)]
-        if len(l) > 1:
-            raise ValueError('')
-        return l[0]
+    def __init__(self, path=None, max_entries=100000, content_hash=False,
+                 enabled=True):
+        if path is None:
+            path = os.environ.get(
+                'RECIPES_CACHE',
+                join(os.path.expanduser('~'), '.cache', 'recipes', 'metrics.sqlite'))
+        self.path = path
+        self.max_entries = max_entries
+        self.content_hash = content_hash
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connect(self):
+        # a connection can't be shared with the forked processes
+        if self._conn is None or self._pid != os.getpid():
+            d = os.path.dirname(self.path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            conn.execute('CREATE TABLE IF NOT EXISTS metrics '
+                         '(key TEXT PRIMARY KEY, value TEXT, atime REAL)')
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def key(self, filename, name, args=()):
+        '''Return the cache key of the metric of the file.'''
+        filename = os.path.abspath(filename)
+        stat = os.stat(filename)
+        key = [name, filename, stat.st_size, stat.st_mtime_ns, list(args)]
+        if self.content_hash:
+            key.append(_fast_hash(filename, stat.st_size))
+        return json.dumps(key)
 
-    return _sort_key
+    def get(self, key):
+        '''Return the value of the key or ``None`` if it is missing.'''
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                'SELECT value FROM metrics WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with conn:
+                conn.execute('UPDATE metrics SET atime = ? WHERE key = ?',
+                             (time.time(), key))
+            return json.loads(row[0])
+
+    def set(self, key, value):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO metrics VALUES (?, ?, ?)',
+                             (key, json.dumps(value), time.time()))
+                n = conn.execute('SELECT COUNT(*) FROM metrics').fetchone()[0]
+                if n > self.max_entries:
+                    conn.execute(
+                        'DELETE FROM metrics WHERE key IN '
+                        '(SELECT key FROM metrics ORDER BY atime LIMIT ?)',
+                        (n - self.max_entries,))
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute('DELETE FROM metrics')
+        self.hits = self.misses = 0
+
+    def stats(self):
+        '''Return the numbers of hits, misses and cached entries.'''
+        with self._lock:
+            n = self._connect().execute('SELECT COUNT(*) FROM metrics').fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': n}
+
+    def cached(self, *names, ignore=()):
+        '''Decorate a function of a file path to check the cache first.
+
+        The decorated function accepts an extra keyword argument
+        ``cache`` to skip the cache for the call. A call passing
+        positional arguments or keyword arguments not given in
+        ``names`` or ``ignore`` skips the cache too, as they may change
+        the value or have side effects.
+
+        Parameters
+        ----------
+        names : str
+            the names of the keyword arguments that affect the value.
+            They are added to the cache key.
+        ignore : iterable of str
+            the names of the keyword arguments that only tune how the
+            value is computed.
+        '''
+        known = set(names).union(ignore)
+
+        def decorator(func):
+            @wraps(func)
+            def wrapper(filename, *args, cache=True, **kwargs):
+                if not (cache and self.enabled) or args or not known.issuperset(kwargs):
+                    return func(filename, *args, **kwargs)
+                try:
+                    key = self.key(filename, func.__name__,
+                                   [kwargs.get(i) for i in names])
+                    value = self.get(key)
+                except (OSError, sqlite3.Error) as e:
+                    getLogger(__name__).warning('Metric cache is not used: %s', e)
+                    return func(filename, **kwargs)
+                if value is None:
+                    value = func(filename, **kwargs)
+                    try:
+                        self.set(key, value)
+                    except sqlite3.Error as e:
+                        getLogger(__name__).warning('Metric cache is not used: %s', e)
+                return value
+            return wrapper
+        return decorator
+
+
+def _fast_hash(filename, size, n=1 << 20):
+    '''Hash the first and last ``n`` bytes of the file.'''
+    h = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(filename, 'rb') as f:
+        h.update(f.read(n))
+        if size > n:
+            f.seek(max(n, size - n))
+            h.update(f.read(n))
+    return h.hexdigest()
+
+
+metric_cache = MetricCache()
 
 
 def count_lines(filename):
-    '''Count line number in a file.'''
+    '''Count line number in a file.
+
+    The line counts are cached in ``metric_cache``.
+    '''
     if filename.endswith('.gz'):
         return count_gzip_lines(filename)
     else:
         return mapcount_lines(filename)
 
 
-def mapcount_lines(filename):
+@metric_cache.cached(ignore=('chunk_size', 'threads'))
+def mapcount_lines(filename, chunk_size=1 << 24, threads=None):
     r'''Count line number in a file with `mmap`.
 
-    It is faster than reading the file line by line.
+    It is faster than reading the file line by line. The mapping
+    is cut into chunks of ``chunk_size`` bytes and the newlines in
+    each chunk are counted on a NumPy view of it, without creating
+    any bytes object. The chunks are counted in a thread pool, as
+    NumPy releases the GIL while counting.
+
+    Parameters
+    ----------
+    filename : str
+        the file path.
+    chunk_size : int
+        number of bytes counted at a time.
+    threads : int or None
+        number of threads to count the chunks. Use the default of
+        ``ThreadPoolExecutor`` if it is ``None``.
 
     Notes
     -----
@@ -245,44 +1671,631 @@ def mapcount_lines(filename):
     >>> with NamedTemporaryFile(delete=False) as fh:
     ...     _ = fh.write(b'a\nb\nc')
     ...     fh.close()
-    ...     lc = mapcount_lines(fh.name)
+    ...     lc = mapcount_lines(fh.name, chunk_size=2, cache=False)
     ...     print(lc)
     3
     '''
     with open(filename, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        # an empty file can't be mapped
+        if size == 0:
+            return 0
         with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
-            lines = 0
-            while buf.readline():
-                lines += 1
-            return lines
+            return _count_mapped_lines(buf, chunk_size, threads)
+
+
+def _count_mapped_lines(buf, chunk_size, threads):
+    size = len(buf)
+    lines = sum(_map_chunks(
+        partial(_count_byte, buf, b'\n'), size, chunk_size, threads))
+    # the last line has no newline
+    if buf[size - 1:size] != b'\n':
+        lines += 1
+    return lines
+
+
+def _map_chunks(func, size, chunk_size, threads=None):
+    '''Apply ``func(start, stop)`` to the chunks of ``range(size)``.
+
+    The chunks are done in a thread pool if there are more than one.
+    '''
+    starts = range(0, size, chunk_size)
+    stops = [min(i + chunk_size, size) for i in starts]
+    if len(starts) < 2 or threads == 1:
+        return list(map(func, starts, stops))
+    with ThreadPoolExecutor(threads) as executor:
+        return list(executor.map(func, starts, stops))
+
+
+def _count_byte(buf, byte, start, stop):
+    '''Count the occurrences of a single byte in ``buf[start:stop]``.'''
+    a = np.frombuffer(buf, dtype=np.uint8, count=stop - start, offset=start)
+    return int(np.count_nonzero(a == ord(byte)))
+
+
+def _count_headers(buf, start, stop):
+    '''Count the FASTA headers whose preceding newline is in the chunk.'''
+    stop = min(stop + 1, len(buf))
+    a = np.frombuffer(buf, dtype=np.uint8, count=stop - start, offset=start)
+    return int(np.count_nonzero((a[:-1] == ord('\n')) & (a[1:] == ord('>'))))
 
 
-def count_gzip_lines(filename):
+@metric_cache.cached(ignore=('chunk_size', 'processes'))
+def count_gzip_lines(filename, chunk_size=1 << 24, processes=1, index=False):
     '''Count line number in a gzipped file.
+
+    The file is decompressed in chunks and the newlines are counted
+    on the raw bytes. For BGZF files (e.g. written by ``bgzip``) and
+    the files written by `ParallelGzipWriter`, the size of each gzip
+    member is recorded in its header, so the members are located
+    without decompression and counted in a process pool. Other
+    multi-member gzip files, such as the output of ``pigz``, don't
+    record the member sizes and are counted serially.
+
+    Parameters
+    ----------
+    filename : str
+        the gzipped file path.
+    chunk_size : int
+        number of bytes decompressed at a time. It is also about
+        the size of compressed data counted by each process.
+    processes : int
+        number of processes to count the members of a file that
+        records their sizes.
+    index : bool
+        whether to save the member offsets and line counts into a
+        sidecar file (see ``_gzip_index_path``). If it exists and
+        the file has not changed since, the line count is read from
+        it without decompression.
+
+    Returns
+    -------
+    int
     '''
-    with gzip.open(filename) as f:
-        for i, l in enumerate(f, 1):
-            pass
-        return i
+    if index:
+        members = _load_gzip_index(filename)
+        if members is not None:
+            return _sum_member_lines(members)
+
+    spans = None
+    if processes > 1:
+        spans = _member_spans(filename, chunk_size)
+    if spans is None:
+        with open(filename, 'rb') as f:
+            members = _count_gzip_members(f, chunk_size)
+    else:
+        members = []
+        with ProcessPoolExecutor(processes) as executor:
+            for i in executor.map(_count_gzip_span, itertools.repeat(filename), *zip(*spans)):
+                members.extend(i)
+
+    if index:
+        _save_gzip_index(filename, members)
+    return _sum_member_lines(members)
 
 
-def count_seq(filename):
-    '''Count seq number in the file.
+def _count_gzip_members(f, chunk_size, start=0):
+    '''Count the newlines in each gzip member of the file object.
 
-    The file can be gzipped.
+    Returns
+    -------
+    list of list
+        the file offset, the newline count and the last byte of
+        each member.
+    '''
+    members = []
+    # number of the compressed bytes fed to the finished members
+    consumed = start
+    d = None
+    buf = f.read(chunk_size)
+    while buf:
+        if d is None:
+            # some tools pad the file with zeros after the last member
+            if not buf.strip(b'\x00'):
+                consumed += len(buf)
+                buf = f.read(chunk_size)
+                continue
+            d = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            members.append([consumed, 0, b''])
+            fed = 0
+        out = d.decompress(buf, chunk_size)
+        members[-1][1] += out.count(b'\n')
+        if out:
+            members[-1][2] = out[-1:]
+        if d.eof:
+            consumed += fed + len(buf) - len(d.unused_data)
+            buf = d.unused_data or f.read(chunk_size)
+            d = None
+        elif d.unconsumed_tail:
+            fed += len(buf) - len(d.unconsumed_tail)
+            buf = d.unconsumed_tail
+        else:
+            fed += len(buf)
+            buf = f.read(chunk_size)
+    if d is not None:
+        raise EOFError('Compressed file ended before the '
+                       'end-of-stream marker was reached')
+    return members
+
+
+def _count_gzip_span(filename, start, stop):
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        data = io.BytesIO(f.read(stop - start))
+    return _count_gzip_members(data, len(data.getbuffer()), start)
+
+
+def _sum_member_lines(members):
+    lines = sum(i[1] for i in members)
+    # the last line has no newline
+    last = [i[2] for i in members if i[2]]
+    if last and last[-1] != b'\n':
+        lines += 1
+    return lines
+
+
+def _member_spans(filename, chunk_size):
+    '''Group the gzip members into spans of about ``chunk_size`` bytes.
+
+    Returns
+    -------
+    list of tuple or None
+        the start and stop offsets of the spans. ``None`` if a member
+        doesn't record its size (see `_member_size`).
     '''
-    for i, s in enumerate(read(filename, format='fasta'), 1):
-        pass
-    return i
+    spans = []
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        start = offset = 0
+        while offset < size:
+            f.seek(offset)
+            header = f.read(12)
+            # a member with FEXTRA flag
+            if header[:4] != b'\x1f\x8b\x08\x04':
+                return None
+            extra = f.read(int.from_bytes(header[10:12], 'little'))
+            bsize = _member_size(extra)
+            if bsize is None:
+                return None
+            offset += bsize
+            if offset - start >= chunk_size:
+                spans.append((start, offset))
+                start = offset
+        if start < offset:
+            spans.append((start, offset))
+    return spans
 
 
-def summarize_blast6(filename):
-    df = read(filename, format="blast+6", into=pd.DataFrame, default_columns=True)
-    df_best = filter_best(df)
+def _bgzf_block_size(extra):
+    '''Return the block size recorded in the "BC" subfield of BGZF.'''
+    i = 0
+    while i + 4 <= len(extra):
+        slen = int.from_bytes(extra[i + 2:i + 4], 'little')
+        if extra[i:i + 2] == b'BC' and slen == 2:
+            return int.from_bytes(extra[i + 4:i + 6], 'little') + 1
+        i += 4 + slen
+    return None
+
+
+def _member_size(extra):
+    '''Return the member size recorded in the "BC" subfield of BGZF
+    or the "PZ" subfield of `ParallelGzipWriter`.'''
+    size = _bgzf_block_size(extra)
+    if size is not None:
+        return size
+    i = 0
+    while i + 4 <= len(extra):
+        slen = int.from_bytes(extra[i + 2:i + 4], 'little')
+        if extra[i:i + 2] == b'PZ' and slen == 4:
+            return int.from_bytes(extra[i + 4:i + 8], 'little')
+        i += 4 + slen
+    return None
+
+
+def _gzip_index_path(filename):
+    return filename + '.lines.json'
+
+
+def _load_gzip_index(filename):
+    '''Load the member line counts if the file is not changed.'''
+    try:
+        with open(_gzip_index_path(filename)) as f:
+            idx = json.load(f)
+    except (OSError, ValueError):
+        return None
+    stat = os.stat(filename)
+    if idx.get('size') != stat.st_size or idx.get('mtime_ns') != stat.st_mtime_ns:
+        return None
+    return [[i, n, last.encode('latin-1')] for i, n, last in idx['members']]
+
+
+def _save_gzip_index(filename, members):
+    stat = os.stat(filename)
+    idx = {'size': stat.st_size,
+           'mtime_ns': stat.st_mtime_ns,
+           'members': [[i, n, last.decode('latin-1')] for i, n, last in members]}
+    try:
+        with open(_gzip_index_path(filename), 'w') as f:
+            json.dump(idx, f)
+    except OSError as e:
+        # e.g. a read-only data dir; the count is still returned
+        getLogger(__name__).warning('Line count index is not saved: %s', e)
+
+
+@metric_cache.cached('format', ignore=('chunk_size', 'threads'))
+def count_seq(filename, format=None, chunk_size=1 << 24, threads=None):
+    r'''Count seq number in the file.
+
+    The file can be gzipped. The records are counted on the raw bytes
+    in large chunks without parsing them: a FASTA record is counted
+    by its header line starting with ">", and a FASTQ record by
+    every 4 lines. The chunks of a plain file are counted in a thread
+    pool as `mapcount_lines` does, and a gzipped FASTQ file is
+    counted with `count_gzip_lines`.
+
+    Parameters
+    ----------
+    filename : str
+        the file path.
+    format : {'fasta', 'fastq', None}
+        the file format. It is detected from the first byte if it
+        is ``None``.
+    chunk_size : int
+        number of bytes counted at a time.
+    threads : int or None
+        number of threads to count the chunks of a plain file.
+
+    Examples
+    --------
+    >>> from tempfile import NamedTemporaryFile
+    >>> with NamedTemporaryFile(delete=False) as fh:
+    ...     _ = fh.write(b'>a\nAT\nGC\n>b\nA\n')
+    ...     fh.close()
+    ...     print(count_seq(fh.name, chunk_size=3, cache=False))
+    2
+    '''
+    if filename.endswith('.gz'):
+        with gzip.open(filename) as f:
+            if _detect_format(f.read(1), format) == 'fastq':
+                return count_gzip_lines(filename, chunk_size=chunk_size) // 4
+            f.seek(0)
+            n = 0
+            last = b'\n'
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return n
+                n += chunk.count(b'\n>')
+                # a header right after the previous chunk
+                if last == b'\n' and chunk[:1] == b'>':
+                    n += 1
+                last = chunk[-1:]
+
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if _detect_format(buf[:1], format) == 'fastq':
+                return _count_mapped_lines(buf, chunk_size, threads) // 4
+            n = sum(_map_chunks(
+                partial(_count_headers, buf), len(buf), chunk_size, threads))
+            return n + (buf[:1] == b'>')
+
+
+@metric_cache.cached('cutoff', 'levels')
+def fasta_stats(filename, cutoff=500, levels=(50, 90)):
+    '''Compute the assembly stats of the contigs in a FASTA file.
+
+    The contigs are read one by one without building sequences and
+    only their lengths are counted, so it runs in a single streaming
+    pass. The result is cached in ``metric_cache``.
+
+    See Also
+    --------
+    assembly_stats
+    '''
+    return assembly_stats(
+        (len(rec) for rec in read_records(filename, 'fasta')), cutoff, levels)
+
+
+def count_sample_table(df, d=None, func=count_seq, processes=None,
+                       max_pending=None, progress=None):
+    '''Count every file of the sample table in a process pool.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        sample-by-file table, e.g. the output of `create_sample_table`.
+        The missing cells are left missing in the output.
+    d : str or None
+        dir to the files. The cells are used as the file paths as
+        they are if it is ``None``.
+    func : callable
+        the function to count a file. It must be picklable. It
+        counts the reads by default.
+    processes : int or None
+        number of worker processes. Use the number of CPUs if it
+        is ``None``.
+    max_pending : int or None
+        max number of files submitted to the pool but not done yet.
+        It is twice the number of processes if it is ``None``.
+    progress : callable or None
+        called with the number of files done and the total number
+        after each file is counted.
+
+    Returns
+    -------
+    pandas.DataFrame
+        the counts in the same shape as ``df`` with "Int64" dtype.
+    '''
+    logger = getLogger(__name__)
+
+    cells = [(i, j, f) for i, row in df.iterrows()
+             for j, f in row.items() if pd.notnull(f)]
+    total = len(cells)
+    counts = pd.DataFrame(index=df.index, columns=df.columns, dtype='Int64')
+    if processes is None:
+        processes = os.cpu_count()
+    if max_pending is None:
+        max_pending = 2 * processes
+
+    with ProcessPoolExecutor(processes) as executor:
+        pending = {}
+        cells = iter(cells)
+        done = 0
+        while True:
+            # keep the pool busy but bound the work in flight
+            for i, j, f in itertools.islice(cells, max_pending - len(pending)):
+                if d is not None:
+                    f = join(d, f)
+                pending[executor.submit(func, f)] = (i, j)
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                i, j = pending.pop(future)
+                counts.loc[i, j] = future.result()
+                done += 1
+                logger.debug('Counted %d/%d files', done, total)
+                if progress is not None:
+                    progress(done, total)
+    return counts
+
+
+def summarize_blast6(filename, column='evalue'):
+    '''Return the best hit of each query in a blast+6 file.'''
+    return best_blast_hits(filename, column)
+
+
+# the default columns of blast+6 output and their types
+BLAST6_COLUMNS = {
+    'qseqid': str, 'sseqid': str, 'pident': np.float64, 'length': np.int64,
+    'mismatch': np.int64, 'gapopen': np.int64, 'qstart': np.int64,
+    'qend': np.int64, 'sstart': np.int64, 'send': np.int64,
+    'evalue': np.float64, 'bitscore': np.float64}
+
+
+def read_blast6(fp, chunksize=None):
+    '''Read a blast+6 file with the default columns typed.
+
+    Parameters
+    ----------
+    fp : str or file object
+        the blast+6 file.
+    chunksize : int or None
+        if it is given, return an iterator of DataFrames of
+        ``chunksize`` rows. The row index runs on across chunks.
+
+    Returns
+    -------
+    pandas.DataFrame or iterator of pandas.DataFrame
+    '''
+    return pd.read_csv(fp, sep='\t', header=None, names=list(BLAST6_COLUMNS),
+                       dtype=BLAST6_COLUMNS, chunksize=chunksize)
+
+
+def iter_best_blast_hits(fp, column='evalue', tie_break=None,
+                         chunksize=1000000, grouped=True):
+    '''Yield the best hit of each query while reading a blast+6 file.
+
+    The file is read in chunks of typed columns. BLAST writes all the
+    hits of a query together, so with ``grouped`` the best hits of
+    the queries in a chunk are yielded as soon as the next query
+    starts, and only the rows of the last query are carried over to
+    the next chunk. The memory use is bounded by the chunk size.
+    Otherwise the current best hit of every query is kept until the
+    end of the file.
+
+    Parameters
+    ----------
+    fp : str or file object
+        the blast+6 file.
+    column : {'evalue', 'bitscore'}
+        pick the hit of the lowest e-value or the highest bitscore.
+    tie_break : {None, 'evalue', 'bitscore'}
+        the column to break the ties of ``column``. The first hit in
+        the file wins the remaining ties, as `filter_best_blast_hit`
+        does.
+    chunksize : int
+        number of rows read at a time.
+    grouped : bool
+        whether the hits of each query are contiguous in the file.
+
+    Yields
+    ------
+    pandas.DataFrame
+        the best hits in the file order, indexed by row number.
+    '''
+    keys = _best_hit_keys(column, tie_break)
+    carry = None
+    for chunk in read_blast6(fp, chunksize=chunksize):
+        if carry is not None:
+            chunk = pd.concat([carry, chunk])
+        if grouped:
+            qseqid = chunk['qseqid'].to_numpy()
+            # the start of the last query, which may go on in the next chunk
+            i = np.flatnonzero(qseqid != qseqid[-1])
+            i = i[-1] + 1 if len(i) else 0
+            # only the best hit so far of the last query is carried over
+            carry = _best_hit_rows(chunk.iloc[i:], keys)
+            if i:
+                yield _best_hit_rows(chunk.iloc[:i], keys)
+        else:
+            carry = _best_hit_rows(chunk, keys)
+    if carry is not None:
+        yield _best_hit_rows(carry, keys)
+
+
+def best_blast_hits(fp, column='evalue', tie_break=None,
+                    chunksize=1000000, grouped=False, processes=1):
+    '''Return the best hit of each query in a blast+6 file.
+
+    It gives the same result as reading the whole file and calling
+    `filter_best_blast_hit` on it, but only holds a chunk of the
+    file in memory. See `iter_best_blast_hits` for the parameters.
+
+    With more than one process, the file is cut into byte ranges at
+    the lines where the query changes. Each range is reduced in a
+    separate process, and the winners of all the ranges are reduced
+    again in the row order, so the ties are resolved exactly as in
+    a single process even if the hits of a query are not contiguous.
+
+    Parameters
+    ----------
+    processes : int
+        number of processes. ``fp`` must be a file path if it is
+        larger than 1.
+
+    Returns
+    -------
+    pandas.DataFrame
+        the best hits sorted by query ID.
+    '''
+    keys = _best_hit_keys(column, tie_break)
+    if processes > 1:
+        shards = _blast6_shards(fp, processes)
+        best = []
+        offset = 0
+        with ProcessPoolExecutor(processes) as executor:
+            for df, rows in executor.map(
+                    _best_blast_hits_shard, itertools.repeat(fp), *zip(*shards),
+                    itertools.repeat(column), itertools.repeat(tie_break),
+                    itertools.repeat(chunksize), itertools.repeat(grouped)):
+                # the row numbers in the whole file
+                df.index += offset
+                offset += rows
+                best.append(df)
+    else:
+        best = list(iter_best_blast_hits(fp, column, tie_break, chunksize, grouped))
+    best = [df for df in best if len(df)]
+    if not best:
+        return pd.DataFrame(columns=list(BLAST6_COLUMNS))
+    best = _best_hit_rows(pd.concat(best), keys)
+    return best.sort_values('qseqid', kind='mergesort')
+
+
+def _blast6_shards(filename, n):
+    '''Cut the file into at most n byte ranges at the query boundaries.'''
+    size = os.path.getsize(filename)
+    bounds = [0]
+    with open(filename, 'rb') as f:
+        for i in range(1, n):
+            start = _next_query_start(f, size * i // n)
+            if bounds[-1] < start < size:
+                bounds.append(start)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _next_query_start(f, offset):
+    '''Return the start of the first line at or after ``offset`` whose
+    query differs from that of the line before it.'''
+    if offset == 0:
+        return 0
+    # move to the start of a line
+    f.seek(offset - 1)
+    f.readline()
+    query = None
+    while True:
+        pos = f.tell()
+        line = f.readline()
+        if not line:
+            return pos
+        q = line.split(b'\t', 1)[0]
+        if query is not None and q != query:
+            return pos
+        query = q
+
+
+def _best_blast_hits_shard(filename, start, stop, column, tie_break, chunksize, grouped):
+    '''Reduce the byte range of the file to the best hits.
+
+    Returns
+    -------
+    tuple
+        the best hits indexed by the row number in the range, and
+        the number of rows in the range.
+    '''
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        reader = _RangeReader(f, stop - start)
+        best = list(iter_best_blast_hits(reader, column, tie_break, chunksize, grouped))
+    if best:
+        best = pd.concat(best)
+    else:
+        best = pd.DataFrame(columns=list(BLAST6_COLUMNS))
+    return best, reader.lines
+
+
+class _RangeReader:
+    '''Read at most ``size`` bytes of a file and count the lines read.'''
+    def __init__(self, f, size):
+        self._f = f
+        self._left = size
+        self._last = b'\n'
+        self.newlines = 0
+
+    @property
+    def lines(self):
+        # the last line has no newline
+        return self.newlines + (self._last != b'\n')
+
+    def read(self, n=-1):
+        if n is None or n < 0 or n > self._left:
+            n = self._left
+        data = self._f.read(n)
+        self._left -= len(data)
+        self.newlines += data.count(b'\n')
+        if data:
+            self._last = data[-1:]
+        return data
+
+
+def _best_hit_keys(column, tie_break=None):
+    '''Return the sort keys and whether each is ascending.'''
+    keys = [column] if tie_break is None else [column, tie_break]
+    for k in keys:
+        if k not in ('evalue', 'bitscore'):
+            raise ValueError('Unknown column to pick the best hits: {}'.format(k))
+    # the lower the e-value, the better the hit
+    return keys, [k == 'evalue' for k in keys]
+
+
+def _best_hit_rows(df, keys):
+    '''Pick the first best row of each query in the row order.'''
+    by, ascending = keys
+    # stable sort keeps the row order for the ties
+    df = df.sort_values(by, ascending=ascending, kind='mergesort')
+    return df[~df['qseqid'].duplicated()].sort_index()
 
 
 def filter_best_blast_hit(df, column='evalue'):
-    '''Filter out the best hits by their e-value or bitscore.'''
+    '''Filter out the best hits by their e-value or bitscore.
+
+    See Also
+    --------
+    best_blast_hits : the same for a blast+6 file too large to load.
+    '''
     # pick the rows that have highest score for each qseqid
     # df_max = df.groupby('qseqid').apply(
     #     lambda r: r[r[column] == r[column].max()])
@@ -290,6 +2303,8 @@ def filter_best_blast_hit(df, column='evalue'):
         idx = df.groupby('qseqid')[column].idxmin()
     elif column == 'bitscore':
         idx = df.groupby('qseqid')[column].idxmax()
+    else:
+        raise ValueError('Unknown column to pick the best hits: {}'.format(column))
     df_best = df.loc[idx]
     # df_best.set_index('qseqid', drop=True, inplace=True)
     return df_best
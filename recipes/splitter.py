@@ -1,3 +1,7 @@
+import re
+from itertools import accumulate, compress
+from operator import ne
+
 
 def split(is_another, construct=None, ignore=None, **kwargs):
     '''Return a function that reads a file to yield entry.
@@ -37,6 +41,10 @@ def split(is_another, construct=None, ignore=None, **kwargs):
     >>> gen = split(lambda s: s.startswith('>'), construct=lambda x: x.strip())
     >>> list(gen(f))
     [['>seq1', 'ATGC'], ['>seq2', 'A', '', 'T']]
+
+    See Also
+    --------
+    split_bytes
     '''
     def parse(stream):
         lines = []
@@ -55,6 +63,182 @@ def split(is_another, construct=None, ignore=None, **kwargs):
     return parse
 
 
+def split_bytes(prefix=None, tail=None, id_column=None, sep=b'\t', comment=None, chunk_size=1 << 20):
+    r'''Return a function that reads a binary file to yield entries as bytes.
+
+    This is the fast path of ``split`` for the common delimiters, which
+    are declared instead of passed as callables: entries that start with
+    a line prefix, entries that end with a tail line, or entries made of
+    consecutive lines sharing an ID column. The file is read in large
+    blocks. The prefix and tail delimiters are found with bytes searches
+    over each block, so no Python code runs per line. In the
+    ``id_column`` mode each block is split into lines whose IDs are
+    compared in bulk; lines without the column have the ID None. Give
+    exactly one of ``prefix``, ``tail`` and ``id_column``.
+
+    Parameters
+    ----------
+    prefix : bytes
+        a line starting with it starts a new entry.
+    tail : bytes
+        a line equal to it, without the line ending, concludes the entry.
+    id_column : int
+        the 0-based column holding the entry ID. Consecutive lines with
+        the same ID belong to the same entry.
+    sep : bytes
+        the column separator for ``id_column``.
+    comment : bytes (optional)
+        the lines starting with it are dropped.
+    chunk_size : int
+        the number of bytes to read at a time.
+
+    Returns
+    -------
+    function
+        a function that accepts a binary file object and yields each entry
+        as the bytes of its lines, line endings included.
+
+    Examples
+    --------
+    >>> import io
+    >>> s = b">seq1\nATGC\n>seq2\nA\t\n\nT\n"
+    >>> gen = split_bytes(prefix=b'>')
+    >>> list(gen(io.BytesIO(s)))
+    [b'>seq1\nATGC\n', b'>seq2\nA\t\n\nT\n']
+    >>> gen = split_bytes(tail=b'//')
+    >>> list(gen(io.BytesIO(b"seq1\nAT\n//\nseq2\nATGC\n//\n")))
+    [b'seq1\nAT\n//\n', b'seq2\nATGC\n//\n']
+    >>> s = b"##gff-version 3\nctg123\t.\texon\nctg123\t.\tCDS\nctg124\t.\texon"
+    >>> gen = split_bytes(id_column=0, comment=b'#')
+    >>> list(gen(io.BytesIO(s)))
+    [b'ctg123\t.\texon\nctg123\t.\tCDS\n', b'ctg124\t.\texon']
+
+    The entries do not depend on where the blocks are cut:
+
+    >>> all(list(split_bytes(id_column=0, comment=b'#', chunk_size=i)(io.BytesIO(s))) ==
+    ...     list(gen(io.BytesIO(s))) for i in range(1, len(s) + 1))
+    True
+
+    See Also
+    --------
+    split
+    '''
+    if (prefix, tail, id_column).count(None) != 2:
+        raise ValueError('Give exactly one of prefix, tail and id_column.')
+    if prefix is not None:
+        delimiter = b'\n' + prefix
+    if comment is not None:
+        comments = re.compile(b'(?m)^' + re.escape(comment) + br'.*(?:\n|\Z)')
+
+    def parse(stream):
+        # the pieces of the current entry and of the incomplete line after it
+        entry = []
+        partial = []
+        ident = None
+        # whether the entry ends with tail lines that may go on
+        in_run = False
+        while True:
+            chunk = stream.read(chunk_size)
+            if chunk:
+                cut = chunk.rfind(b'\n') + 1
+                if not cut:
+                    partial.append(chunk)
+                    continue
+                partial.append(chunk[:cut])
+                lines = b''.join(partial)
+                partial = [chunk[cut:]] if cut < len(chunk) else []
+            else:
+                lines = b''.join(partial)
+                partial = []
+            if comment is not None and (lines.startswith(comment) or b'\n' + comment in lines):
+                lines = comments.sub(b'', lines)
+            # the entries are cut at these offsets of the new lines; only
+            # the new lines are searched, as they start at a line start
+            bounds = []
+            if prefix is not None:
+                if lines.startswith(prefix):
+                    bounds.append(0)
+                i = lines.find(delimiter)
+                while i != -1:
+                    bounds.append(i + 1)
+                    i = lines.find(delimiter, i + 1)
+            elif tail is not None:
+                # a run of tail lines concludes one entry
+                run = [0, 0] if in_run else None
+                for line_start, line_end in _find_lines(lines, tail, 0):
+                    if run and line_start == run[1]:
+                        run[1] = line_end
+                    else:
+                        if run:
+                            bounds.append(run[1])
+                        run = [line_start, line_end]
+                in_run = False
+                if run:
+                    if run[1] < len(lines) or not chunk:
+                        bounds.append(run[1])
+                    else:
+                        # the run may go on in the next block
+                        in_run = True
+            elif lines:
+                rows = lines.split(b'\n')
+                if not rows[-1]:
+                    rows.pop()
+                if id_column:
+                    ids = [f[id_column] if len(f) > id_column else None
+                           for f in (row.split(sep, id_column + 1) for row in rows)]
+                else:
+                    ids = [row.split(sep, 1)[0] for row in rows]
+                changed = list(compress(range(len(ids)), map(ne, ids, [ident] + ids[:-1])))
+                if changed:
+                    # the offset of line i is the length of the lines before
+                    # it plus their newlines
+                    sizes = list(accumulate(map(len, rows), initial=0))
+                    bounds = [sizes[i] + i for i in changed]
+                ident = ids[-1]
+            start = 0
+            for b in bounds:
+                if b > start:
+                    entry.append(lines[start:b])
+                    start = b
+                if entry:
+                    yield b''.join(entry)
+                    entry = []
+            if start < len(lines):
+                entry.append(lines[start:])
+            if not chunk:
+                break
+        if entry:
+            yield b''.join(entry)
+    return parse
+
+
+def _find_lines(buf, line, pos):
+    '''Yield the start and end of each line equal to line in buf from pos.
+
+    The line ends (``\\n`` or ``\\r\\n``) are included in the line spans.
+    pos must be at the start of a line.
+    '''
+    delimiter = b'\n' + line
+    if pos == 0 and buf.startswith(line):
+        i = -1
+    else:
+        i = buf.find(delimiter, max(pos - 1, 0))
+        if i == -1:
+            return
+    while True:
+        start = i + 1
+        end = start + len(line)
+        if buf.startswith(b'\n', end):
+            yield start, end + 1
+        elif buf.startswith(b'\r\n', end):
+            yield start, end + 2
+        elif end == len(buf):
+            yield start, end
+        i = buf.find(delimiter, end)
+        if i == -1:
+            return
+
+
 class AnotherEntryTail:
     r'''Check if a new entry starts.
 
@@ -0,0 +1,59 @@
+from unittest import TestCase, main
+
+import numpy as np
+
+from recipes.interval import IntervalIndex
+
+
+class Tests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.rng = rng
+
+    def _check(self, n, max_len):
+        rng = self.rng
+        starts = rng.integers(0, 2000, n)
+        ends = starts + rng.integers(0, max_len, n)
+        index = IntervalIndex.from_arrays(starts, ends)
+        s, e = index.starts, index.ends
+        xs = rng.integers(-5, 2100, 100)
+        ys = xs + rng.integers(0, 50, 100)
+        q, i = index.stab_many(xs)
+        exp = [(a, b) for a in range(len(xs)) for b in range(n) if s[b] <= xs[a] < e[b]]
+        self.assertEqual(list(zip(q.tolist(), i.tolist())), exp)
+        q, i = index.overlap_many(xs, ys)
+        exp = [(a, b) for a in range(len(xs)) for b in range(n) if s[b] < ys[a] and xs[a] < e[b]]
+        self.assertEqual(list(zip(q.tolist(), i.tolist())), exp)
+        np.testing.assert_array_equal(index.count_many(xs, ys), np.bincount(q, minlength=len(xs)))
+        for a in range(0, len(xs), 10):
+            self.assertEqual(index.stab(xs[a]),
+                             [index.payloads[b] for b in range(n) if s[b] <= xs[a] < e[b]])
+            self.assertEqual(index.overlap(xs[a], ys[a]),
+                             [index.payloads[b] for b in range(n) if s[b] < ys[a] and xs[a] < e[b]])
+
+    def test_queries(self):
+        for n in (0, 1, 2, 15, 16, 17, 100, 1000, 3000):
+            for max_len in (1, 20, 1000):
+                with self.subTest(n=n, max_len=max_len):
+                    self._check(n, max_len)
+
+    def test_records(self):
+        index = IntervalIndex([(5, 10, 'b'), (0, 3.5, 'a'), (5, 7, 'c')])
+        self.assertEqual(index.payloads, ['a', 'b', 'c'])
+        self.assertEqual(index.ends.dtype, np.float64)
+        self.assertEqual(index.stab(3), ['a'])
+        self.assertEqual(index.stab(3.5), [])
+        self.assertEqual(index.overlap(3, 6), ['a', 'b', 'c'])
+        self.assertEqual(index.count_many([0, 5, 9, 10]).tolist(), [1, 2, 1, 0])
+        self.assertEqual(len(IntervalIndex()), 0)
+        self.assertEqual(IntervalIndex().stab(1), [])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            IntervalIndex([(5, 1, 'a')])
+        with self.assertRaises(ValueError):
+            IntervalIndex.from_arrays([1, 2], [3])
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,11 @@
 from unittest import TestCase, main
+import os
 from tempfile import TemporaryDirectory
-from os.path import join
+from os.path import join, dirname
 import re
+import io
 import gzip
+import zlib
 
 import numpy as np
 import pandas as pd
@@ -11,11 +14,23 @@ from skbio import DNA
 import skbio
 
 from recipes.ngs import (
-    create_sample_table, split_paired_end, equal_seqs,
-    count_gzip_lines)
+    create_sample_table, scan_dir, PatternMatcher, count_sample_table,
+    split_paired_end, split_paired_end_batch,
+    equal_seqs, equal_seq_files, assembly_stats, fasta_stats, count_seq,
+    read_blast6, best_blast_hits, iter_best_blast_hits, filter_best_blast_hit,
+    count_gzip_lines, mapcount_lines, MetricCache, metric_cache,
+    external_sort, ParallelGzipWriter, BgzfWriter, BgzfReader, read_records,
+    _member_spans)
 
 
 class Tests(TestCase):
+    def setUp(self):
+        # keep the tests from reading or writing the user cache
+        metric_cache.enabled = False
+
+    def tearDown(self):
+        metric_cache.enabled = True
+
     def test_create_sample_table(self):
         with TemporaryDirectory() as d:
             sids = ['285', 'Dust.1', 'Dust.2']
@@ -32,23 +47,343 @@ class Tests(TestCase):
 
             self.assertEqual(exp.to_dict(), obs.to_dict())
 
+    def test_pattern_matcher(self):
+        patterns = ['R1', re.compile('R2'), '(a)\\1']
+        match = PatternMatcher(patterns)
+        self.assertIsNone(match._regex)
+        self.assertEqual([match(i) for i in ['x_R2', 'R1', 'aa']], [1, 0, 2])
+        match = PatternMatcher(['^R1', re.compile('R2$')])
+        self.assertEqual([match(i) for i in ['R1_x', 'R1_R1', 'x_R2']], [0, 0, 1])
+        with self.assertRaisesRegex(ValueError, 'more than one'):
+            match('R1_R2')
+        with self.assertRaisesRegex(ValueError, 'does not match'):
+            match('R2_R1')
+        with self.assertRaisesRegex(ValueError, 'more than one'):
+            create_sample_table(
+                join(dirname(get_data_path('r1.fq.gz'))), ['R1', 'R2'], ['r1', 'fq'],
+                get_id=lambda x: x)
+
+    def test_create_sample_table_recursive(self):
+        with TemporaryDirectory() as d:
+            types = ['R1_paired', 'R2_paired']
+            os.makedirs(join(d, 'run1', 'lane1'))
+            os.mkdir(join(d, 'run2'))
+            files = [join('run1', 'lane1', 'a_R2_paired.fq'),
+                     join('run2', 'a_R1_paired.fq'),
+                     'b_R1_paired.fq', join('run2', 'b_R2_paired.fq')]
+            for i in files:
+                open(join(d, i), 'w').close()
+            manifest = join(d, 'manifest.json')
+            kwargs = dict(get_id=lambda x: re.split('_R[12]_', x)[0],
+                          select=lambda x: x.endswith('.fq'),
+                          recursive=True, threads=2, manifest=manifest)
+            exp = pd.DataFrame([files[1::-1], files[2:]], index=['a', 'b'], columns=types)
+            obs = create_sample_table(d, types, types, **kwargs)
+            self.assertEqual(exp.to_dict(), obs.to_dict())
+            # from the manifest
+            obs = create_sample_table(d, types, types, **kwargs)
+            self.assertEqual(exp.to_dict(), obs.to_dict())
+            # the changed dir is listed again
+            os.remove(join(d, files[0]))
+            obs = create_sample_table(d, types, types, **kwargs)
+            self.assertEqual(obs.loc['a', 'R1_paired'], files[1])
+            self.assertTrue(pd.isnull(obs.loc['a', 'R2_paired']))
+            self.assertEqual(sorted(scan_dir(d)), ['b_R1_paired.fq', 'manifest.json'])
+            # the symlinks to dirs are not followed
+            os.symlink('..', join(d, 'run2', 'loop'))
+            os.symlink('run2', join(d, 'run3'))
+            self.assertEqual(sorted(scan_dir(d, recursive=True)),
+                             sorted(['b_R1_paired.fq', 'manifest.json',
+                                     join('run2', 'a_R1_paired.fq'), join('run2', 'b_R2_paired.fq')]))
+
+    def test_count_sample_table(self):
+        files = [['r1.fq.gz', 'r2.fq.gz'], ['r1_unpaired.fq.gz', None]]
+        df = pd.DataFrame(files, index=['a', 'b'], columns=['R1', 'R2'])
+        calls = []
+        obs = count_sample_table(
+            df, d=dirname(get_data_path('r1.fq.gz')), processes=2, max_pending=1,
+            progress=lambda done, total: calls.append((done, total)))
+        exp = pd.DataFrame([[2, 2], [2, None]], index=['a', 'b'],
+                           columns=['R1', 'R2'], dtype='Int64')
+        pd.testing.assert_frame_equal(obs, exp)
+        self.assertEqual(calls, [(1, 3), (2, 3), (3, 3)])
+
+    def test_assembly_stats(self):
+        rng = np.random.RandomState(0)
+        nums = rng.randint(0, 2000, 1000)
+        for cutoff in [0, 500, 3000]:
+            exp = sorted((i for i in nums if i >= cutoff), reverse=True)
+            total = sum(exp)
+            obs = assembly_stats(nums, cutoff, levels=(10, 50, 90, 100))
+            self.assertEqual(obs, assembly_stats(list(nums), cutoff, levels=(10, 50, 90, 100)))
+            self.assertEqual(obs['total'], total)
+            self.assertEqual(obs['count'], len(exp))
+            for x in [10, 50, 90, 100]:
+                # the naive way
+                cum = np.cumsum(exp)
+                i = np.searchsorted(cum, total * x / 100) if exp else None
+                self.assertEqual(obs['N%d' % x], exp[i] if exp else 0)
+                self.assertEqual(obs['L%d' % x], i + 1 if exp else 0)
+
+    def test_fasta_stats(self):
+        with TemporaryDirectory() as d:
+            f = join(d, 'a.fa')
+            with open(f, 'w') as fh:
+                fh.write('>a\nAAAA\nAA\n>b\nAAA\n>c\nA\n')
+            obs = fasta_stats(f, cutoff=0)
+        self.assertEqual(obs, {'count': 3, 'total': 10, 'N50': 6, 'L50': 1,
+                               'N90': 3, 'L90': 2})
+
+    def _write_blast6(self, f, grouped=True, n=300, queries=40):
+        rng = np.random.RandomState(0)
+        q = np.sort(rng.randint(0, queries, n)) if grouped else rng.randint(0, queries, n)
+        df = pd.DataFrame({
+            'qseqid': ['q%d' % i for i in q],
+            'sseqid': ['s%d' % i for i in range(n)],
+            'pident': 100.0, 'length': 100, 'mismatch': 0, 'gapopen': 0,
+            'qstart': 1, 'qend': 100, 'sstart': 1, 'send': 100,
+            # make ties
+            'evalue': rng.choice([1e-10, 1e-5, 0.1], n),
+            'bitscore': rng.choice([50.0, 100.0], n)})
+        df.to_csv(f, sep='\t', header=False, index=False)
+
+    def test_best_blast_hits(self):
+        with TemporaryDirectory() as d:
+            f = join(d, 'a.blast6')
+            # a single query has its hits over all the chunks
+            for grouped, queries in [(True, 40), (False, 40), (True, 1)]:
+                self._write_blast6(f, grouped, queries=queries)
+                df = read_blast6(f)
+                for column in ['evalue', 'bitscore']:
+                    exp = filter_best_blast_hit(df, column)
+                    for chunksize in [1, 7, 1000]:
+                        obs = best_blast_hits(f, column, chunksize=chunksize, grouped=grouped)
+                        pd.testing.assert_frame_equal(obs, exp)
+                    for processes in [2, 5]:
+                        obs = best_blast_hits(f, column, chunksize=10, grouped=grouped,
+                                              processes=processes)
+                        pd.testing.assert_frame_equal(obs, exp)
+
+    def test_best_blast_hits_tie_break(self):
+        with TemporaryDirectory() as d:
+            f = join(d, 'a.blast6')
+            self._write_blast6(f)
+            df = read_blast6(f)
+            obs = pd.concat(iter_best_blast_hits(
+                f, 'evalue', tie_break='bitscore', chunksize=10))
+            for q, hit in obs.set_index('qseqid').iterrows():
+                hits = df[df['qseqid'] == q]
+                hits = hits[hits['evalue'] == hits['evalue'].min()]
+                self.assertEqual(hit['bitscore'], hits['bitscore'].max())
+            self.assertEqual(len(obs), df['qseqid'].nunique())
+            with self.assertRaises(ValueError):
+                best_blast_hits(f, 'pident')
+
     def test_equals_seqs(self):
         seq1 = [DNA('ATGC'), DNA('A')]
         seq2 = [DNA('A'), DNA('ATGC')]
         self.assertTrue(equal_seqs(seq1, seq2))
+        seq3 = [DNA('A', metadata={'id': 'a'}), DNA('ATGC')]
+        self.assertFalse(equal_seqs(seq1, seq3))
+        seq4 = [DNA('A', positional_metadata={'quality': [30]}), DNA('ATGC')]
+        self.assertFalse(equal_seqs(seq1, seq4))
+        # the types and the other metadata are compared too
+        self.assertFalse(equal_seqs([DNA('ACG')], [skbio.Sequence('ACG')]))
+        self.assertFalse(equal_seqs([DNA('A', metadata={'x': 1})], [DNA('A')]))
+        self.assertFalse(equal_seqs([DNA('A', positional_metadata={'x': [1]})], [DNA('A')]))
+        seq5 = [DNA('A', metadata={'x': 1}), DNA('A', metadata={'x': 2})]
+        self.assertTrue(equal_seqs(seq5, seq5[::-1]))
 
-    def test_split_paired_end(self):
+    def test_equal_seq_files(self):
+        merged = get_data_path('merged.fq.gz')
+        with gzip.open(merged) as fh:
+            lines = fh.read().splitlines(keepends=True)
+        with TemporaryDirectory() as d:
+            f = join(d, 'a.fq')
+            # swap the first 2 records
+            with open(f, 'wb') as fh:
+                fh.write(b''.join(lines[4:8] + lines[:4] + lines[8:]))
+            self.assertEqual(equal_seq_files(merged, merged), (True, None))
+            equal, (i, r1, r2) = equal_seq_files(merged, f)
+            self.assertTrue(equal)
+            self.assertEqual((i, r1.id, r2.id), (0, lines[0].split()[0][1:], lines[4].split()[0][1:]))
+            # change a quality score
+            with open(f, 'wb') as fh:
+                fh.write(b''.join(lines[:-1] + [b'#' + lines[-1][1:]]))
+            equal, (i, r1, r2) = equal_seq_files(merged, f)
+            self.assertFalse(equal)
+            self.assertEqual(i, 7)
+            # one more record
+            with open(f, 'wb') as fh:
+                fh.write(b''.join(lines + lines[:4]))
+            self.assertEqual(equal_seq_files(merged, f)[0], False)
+            self.assertEqual(equal_seq_files(merged, f)[1][:2], (8, None))
+
+    def _test_split_paired_end(self, mode='rt', **kwargs):
         merged, r1, r2, r1_unpaired, r2_unpaired = [
             get_data_path(i) + '.fq.gz' for i in
             ['merged', 'r1', 'r2',
              'r1_unpaired', 'r2_unpaired']]
-        with TemporaryDirectory() as d, gzip.open(merged, 'rt') as fh:
-            fs = split_paired_end(fh, prefix=join(d, 'test'))
+        with TemporaryDirectory() as d, gzip.open(merged, mode) as fh:
+            fs = split_paired_end(fh, prefix=join(d, 'test'), **kwargs)
             for i, j in zip([r1, r2, r1_unpaired, r2_unpaired], fs):
                 obs = list(skbio.io.read(i, format='fastq'))
                 exp = list(skbio.io.read(j, format='fastq'))
                 self.assertTrue(equal_seqs(obs, exp))
 
+    def test_split_paired_end(self):
+        self._test_split_paired_end()
+
+    def test_split_paired_end_stream(self):
+        self._test_split_paired_end(method='stream')
+
+    def test_split_paired_end_stream_spill(self):
+        with TemporaryDirectory() as tmp:
+            self._test_split_paired_end(
+                method='stream', buffer_size=1, buckets=3, tmpdir=tmp)
+
+    def test_split_paired_end_external(self):
+        self._test_split_paired_end(method='external', chunk_size=3)
+
+    def test_split_paired_end_bytes(self):
+        for method in ['sort', 'stream', 'external']:
+            self._test_split_paired_end(
+                mode='rb', method=method, buffer_size=1, chunk_size=3)
+
+    def test_split_paired_end_batch(self):
+        merged = get_data_path('merged.fq.gz')
+        exp = pd.DataFrame([[2, 2, 2, 2]] * 2, index=['a', 'b'],
+                           columns=['r1', 'r2', 'r1_unpaired', 'r2_unpaired'],
+                           dtype='Int64')
+        with TemporaryDirectory() as d:
+            df = pd.DataFrame({'merged': [merged, merged]}, index=['a', 'b'])
+            obs = split_paired_end_batch(df, d, processes=2, method='stream')
+            pd.testing.assert_frame_equal(obs, exp)
+            self.assertEqual(count_seq(join(d, 'a.r2_unpaired.fq.gz')), 2)
+            obs = split_paired_end_batch([merged, join(d, 'missing.fq')], d, retries=1)
+            self.assertEqual(obs.loc['merged'].tolist(), [2, 2, 2, 2])
+            self.assertTrue(obs.loc['missing'].isnull().all())
+            with self.assertRaisesRegex(ValueError, 'shared by'):
+                split_paired_end_batch([join('run1', 'S1.fq.gz'), join('run2', 'S1.fq.gz')], d)
+
+    def test_bgzf(self):
+        records = ['@r{}\n{}\n+\n{}\n'.format(i, 'A' * (i % 300), 'F' * (i % 300))
+                   for i in range(3000)]
+        with TemporaryDirectory() as d:
+            f = join(d, 'a.fq.gz')
+            with BgzfWriter(f, compresslevel=1, threads=2) as fh:
+                for r in records:
+                    fh.write(r)
+            with gzip.open(f, 'rt') as fh:
+                self.assertEqual(fh.read(), ''.join(records))
+            self.assertEqual(count_gzip_lines(f, processes=2, chunk_size=1 << 16),
+                             len(records) * 4)
+            records = [r.encode() for r in records]
+            with BgzfReader(f) as fh:
+                self.assertEqual(len(fh), len(records))
+                for i in [0, 1, 1234, 2999, -1]:
+                    self.assertEqual(fh[i], records[i])
+                for i in [slice(0, 3000), slice(100, 2000, 7), slice(2990, None), slice(5, 5),
+                          slice(None, None, -1), slice(-70, 5, -3), slice(5, 100, -1)]:
+                    self.assertEqual(fh[i], records[i])
+                with self.assertRaises(IndexError):
+                    fh[3000]
+            # empty file
+            BgzfWriter(f).close()
+            with gzip.open(f) as fh:
+                self.assertEqual(fh.read(), b'')
+            with BgzfReader(f) as fh:
+                self.assertEqual(fh[:], [])
+            # records over whole blocks and empty records between them
+            records = [b'a' * BgzfWriter.BLOCK_SIZE, b'', b'b' * 70000, b'', b'']
+            with BgzfWriter(f, threads=2, max_pending=1) as fh:
+                for r in records:
+                    fh.write(r)
+            with BgzfReader(f) as fh:
+                self.assertEqual([fh[i] for i in range(len(fh))], records)
+                self.assertEqual(fh[:], records)
+
+    def test_split_paired_end_bgzf(self):
+        self._test_split_paired_end(mode='rb', threads=2, bgzf=True)
+        merged = get_data_path('merged.fq.gz')
+        with TemporaryDirectory() as d:
+            fs = split_paired_end(merged, join(d, 'a'), bgzf=True)
+            with BgzfReader(fs[0]) as fh:
+                self.assertEqual(len(fh), 2)
+                self.assertTrue(fh[1].startswith(b'@HWI-D00220:159:C6K8WANXX:3:1101:5935:1933 1'))
+
+    def test_read_records(self):
+        merged = get_data_path('merged.fq.gz')
+        exp = list(skbio.io.read(merged, format='fastq', variant='illumina1.8'))
+        with TemporaryDirectory() as d:
+            plain = join(d, 'merged.fq')
+            with gzip.open(merged) as i, open(plain, 'wb') as o:
+                o.write(i.read())
+            for f, kwargs in [(merged, {'block_size': 100}),
+                              (plain, {})]:
+                obs = list(read_records(f, **kwargs))
+                self.assertEqual(len(obs), len(exp))
+                for i, j in zip(obs, exp):
+                    self.assertEqual(i.id.decode(), j.metadata['id'])
+                    self.assertEqual(i.description.decode(), j.metadata['description'])
+                    self.assertEqual(i.seq.decode(), str(j))
+
+    def test_read_records_fasta(self):
+        fa = b'>s1 a\nAT\nGC\n\n>s2\n>s3\nA'
+        for block_size in [1, 3, 100]:
+            obs = [(rec.id, rec.seq) for rec in
+                   read_records(io.BytesIO(fa), block_size=block_size)]
+            self.assertEqual(obs, [(b's1', b'ATGC'), (b's2', b''), (b's3', b'A')])
+        # a record over many blocks and blank lines at the end
+        fa = b'>s1\n' + b'ACGT\n' * 100 + b'>s2\nA\n\n\n'
+        for block_size in [1, 7, 100]:
+            obs = [(rec.id, len(rec)) for rec in
+                   read_records(io.BytesIO(fa), block_size=block_size)]
+            self.assertEqual(obs, [(b's1', 400), (b's2', 1)])
+        fq = b'@r1\nAT\n+\nFF\n\n@r2\nA\n+\nF\n\n'
+        obs = [rec.id for rec in read_records(io.BytesIO(fq), block_size=2)]
+        self.assertEqual(obs, [b'r1', b'r2'])
+
+    def test_split_paired_end_threads(self):
+        self._test_split_paired_end(method='stream', threads=4, compresslevel=1)
+
+    def test_parallel_gzip_writer(self):
+        lines = ['line {}\n'.format(i) for i in range(1000)]
+        with TemporaryDirectory() as d:
+            f = join(d, 'a.gz')
+            with ParallelGzipWriter(f, block_size=100, threads=3, max_pending=2) as fh:
+                for l in lines:
+                    fh.write(l)
+            with gzip.open(f, 'rt') as fh:
+                self.assertEqual(fh.readlines(), lines)
+            # the members record their sizes to be counted in parallel
+            self.assertGreater(len(_member_spans(f, 100)), 1)
+            self.assertEqual(count_gzip_lines(f, processes=2, chunk_size=100), len(lines))
+            # empty output is still valid gzip
+            ParallelGzipWriter(f).close()
+            with gzip.open(f, 'rt') as fh:
+                self.assertEqual(fh.read(), '')
+
+    def test_external_sort(self):
+        seqs = [('@{}\n'.format(i), 'A\n', '+\n', 'F\n') for i in range(30)]
+        exp = sorted(seqs)
+        with TemporaryDirectory() as tmp:
+            obs = list(external_sort(reversed(seqs), chunk_size=2,
+                                     fan_in=3, tmpdir=tmp))
+        self.assertEqual(obs, exp)
+        self.assertEqual(list(external_sort([])), [])
+
+    def test_mapcount_lines(self):
+        with TemporaryDirectory() as d:
+            f = join(d, 'a.txt')
+            for content, exp in [(b'', 0), (b'\n', 1), (b'a', 1),
+                                 (b'a\nb\n', 2), (b'a\n\nb', 3)]:
+                with open(f, 'wb') as fh:
+                    fh.write(content)
+                for chunk_size in [1, 2, 100]:
+                    self.assertEqual(
+                        mapcount_lines(f, chunk_size=chunk_size, threads=2), exp)
+
     def test_count_gzip_lines(self):
         files = [
             get_data_path(i) + '.fq.gz' for i in
@@ -57,6 +392,143 @@ class Tests(TestCase):
         for f, l in zip(files, lines):
             self.assertEqual(count_gzip_lines(f), l)
 
+    def test_count_seq(self):
+        fq = get_data_path('merged.fq.gz')
+        self.assertEqual(count_seq(fq), 8)
+        fa = b'>s1 a\nAT\n>GC\n>s2\n>s3\nA'
+        with TemporaryDirectory() as d:
+            plain = join(d, 'a.fa')
+            with gzip.open(fq) as i, open(join(d, 'a.fq'), 'wb') as o:
+                o.write(i.read())
+            self.assertEqual(count_seq(join(d, 'a.fq'), chunk_size=5), 8)
+            with open(plain, 'wb') as o:
+                o.write(fa)
+            with gzip.open(plain + '.gz', 'wb') as o:
+                o.write(fa)
+            open(join(d, 'empty'), 'w').close()
+            for chunk_size in [1, 2, 3, 100]:
+                self.assertEqual(count_seq(plain, chunk_size=chunk_size, threads=2), 4)
+                self.assertEqual(count_seq(plain + '.gz', chunk_size=chunk_size), 4)
+            self.assertEqual(count_seq(join(d, 'empty')), 0)
+
+    def _use_metric_cache(self, d):
+        '''Enable ``metric_cache`` with a database in the directory.'''
+        path = metric_cache.path
+
+        def restore():
+            metric_cache.path = path
+            metric_cache._conn = None
+        self.addCleanup(restore)
+        metric_cache.path = join(d, 'cache.sqlite')
+        metric_cache._conn = None
+        metric_cache.enabled = True
+        metric_cache.hits = metric_cache.misses = 0
+
+    def test_count_seq_cached(self):
+        with TemporaryDirectory() as d:
+            self._use_metric_cache(d)
+            f = join(d, 'a.fq')
+            with open(f, 'w') as o:
+                o.write('@a\nAC\n+\nII\n@b\nGT\n+\nII\n')
+            self.assertEqual(count_seq(f, format='fastq'), 2)
+            self.assertEqual(count_seq(f, format='fasta'), 0)
+            self.assertEqual(count_seq(f, format='fastq', chunk_size=3), 2)
+            self.assertEqual(metric_cache.stats()['hits'], 1)
+
+    def test_count_gzip_lines_cached(self):
+        with TemporaryDirectory() as d:
+            self._use_metric_cache(d)
+            f = join(d, 'a.gz')
+            with gzip.open(f, 'wb') as fh:
+                fh.write(b'a\nb\n')
+            self.assertEqual(count_gzip_lines(f), 2)
+            # the sidecar is written on a cached file
+            self.assertEqual(count_gzip_lines(f, index=True), 2)
+            self.assertTrue(os.path.exists(f + '.lines.json'))
+
+    def test_metric_cache(self):
+        with TemporaryDirectory() as d:
+            cache = MetricCache(join(d, 'db', 'cache.sqlite'), max_entries=2,
+                                content_hash=True)
+            calls = []
+
+            @cache.cached('n')
+            def count(filename, n=1):
+                calls.append(filename)
+                return n
+
+            fs = [join(d, str(i)) for i in range(3)]
+            for f in fs:
+                open(f, 'w').close()
+            self.assertEqual(count(fs[0]), 1)
+            self.assertEqual(count(fs[0], n=2), 2)
+            self.assertEqual(count(fs[0]), 1)
+            self.assertEqual(cache.stats(), {'hits': 1, 'misses': 2, 'entries': 2})
+            self.assertEqual(len(calls), 2)
+            # evict the least recently used entry
+            count(fs[1])
+            self.assertEqual(cache.stats()['entries'], 2)
+            count(fs[0], n=2)
+            self.assertEqual(len(calls), 4)
+            # a modified file is recounted
+            with open(fs[1], 'w') as fh:
+                fh.write('a')
+            count(fs[1])
+            self.assertEqual(len(calls), 5)
+            cache.enabled = False
+            count(fs[1])
+            self.assertEqual(len(calls), 6)
+            cache.clear()
+            self.assertEqual(cache.stats(), {'hits': 0, 'misses': 0, 'entries': 0})
+
+    def test_count_gzip_lines_edge(self):
+        with TemporaryDirectory() as d:
+            f = join(d, 'a.gz')
+            open(f, 'wb').close()
+            self.assertEqual(count_gzip_lines(f), 0)
+            for content, exp in [(b'', 0), (b'a', 1), (b'a\nb\n', 2)]:
+                with gzip.open(f, 'wb') as fh:
+                    fh.write(content)
+                self.assertEqual(count_gzip_lines(f, chunk_size=1), exp)
+            # multiple members and zero padding
+            with open(f, 'wb') as fh:
+                fh.write(gzip.compress(b'a\n' * 1000))
+                fh.write(gzip.compress(b'b\nc'))
+                fh.write(b'\x00' * 10)
+            self.assertEqual(count_gzip_lines(f, chunk_size=7), 1002)
+
+    def test_count_gzip_lines_bgzf(self):
+        with TemporaryDirectory() as d:
+            f = join(d, 'a.gz')
+            with open(f, 'wb') as fh:
+                for i in range(100):
+                    fh.write(_bgzf_block(b'line\n' * i))
+                fh.write(_bgzf_block(b'end'))
+                fh.write(_bgzf_block(b''))
+            exp = sum(range(100)) + 1
+            self.assertEqual(count_gzip_lines(f, processes=2, chunk_size=500), exp)
+            self.assertEqual(count_gzip_lines(f, index=True), exp)
+            # read from the index
+            with open(f + '.lines.json') as fh:
+                self.assertIn('members', fh.read())
+            self.assertEqual(count_gzip_lines(f, index=True), exp)
+            # the index can't be written
+            os.remove(f + '.lines.json')
+            os.mkdir(f + '.lines.json')
+            with self.assertLogs('recipes.ngs', 'WARNING'):
+                self.assertEqual(count_gzip_lines(f, index=True), exp)
+
+
+def _bgzf_block(data):
+    '''Compress data into a BGZF block.'''
+    c = zlib.compressobj(6, zlib.DEFLATED, -15)
+    cdata = c.compress(data) + c.flush()
+    bsize = 18 + len(cdata) + 8
+    header = (b'\x1f\x8b\x08\x04' + b'\x00' * 4 + b'\x00\xff' +
+              b'\x06\x00BC\x02\x00' + (bsize - 1).to_bytes(2, 'little'))
+    trailer = zlib.crc32(data).to_bytes(4, 'little') + len(data).to_bytes(4, 'little')
+    return header + cdata + trailer
+
 
 if __name__ == '__main__':
     main()